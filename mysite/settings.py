@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'bootstrap4',
     'widget_tweaks',
     'rest_framework',
+    'django_filters',
     'products',
     'pricelists',
     'printshops',
@@ -143,6 +144,57 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Figure and logo renditions and crop previews, cached under MEDIA_ROOT/renditions and MEDIA_ROOT/previews
+RENDITION_SIZES = {
+    'thumb': (256, 256),
+    'card': (640, 640),
+    'hero': (1600, 1600),
+}
+RENDITION_CACHE_BYTES = 512 * 1024 * 1024
+
+# Crop previews of an order's photos, and the most photos previewed per request
+CROP_PREVIEW_SIZE = (300, 300)
+MAX_PREVIEW_PHOTOS = 20
+
+# Image decoding limits, per image and across each process
+MAX_IMAGE_PIXELS = 120 * 1000000
+IMAGE_PIXEL_BUDGET = 250 * 1000000
+
+# Resolved pricelists, versioned by PriceList.cache_version, kept in the default cache and copied into each process
+PRICE_CACHE_TIMEOUT = 24 * 60 * 60
+PRICE_CACHE_CHECK = 5
+
+# Exchange rate feed, a CSV or ECB style XML file or a directory they are dropped into
+RATE_FEED_PATH = os.path.join(BASE_DIR, 'rates')
+RATE_FEED_BASE = 'EUR'
+
+# Pricelist exports, rendered once per pricelist version, older versions are removed once this many seconds old
+PRICELIST_EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+PRICELIST_EXPORT_MAX_AGE = 10 * 60
+
+# Price and rate history older than the retention period is compacted into the archive
+PRICE_HISTORY_RETENTION_DAYS = 365
+PRICE_HISTORY_ARCHIVE = os.path.join(BASE_DIR, 'archive')
+
+# Print shops near me searches, radii in kilometres
+NEARBY_SHOP_RADIUS = 25
+NEARBY_SHOP_MAX_RADIUS = 500
+NEARBY_SHOP_LIMIT = 10
+NEARBY_SHOP_MAX_LIMIT = 100
+
+# Most products suggested per photo, and photos matched per request, by the photo matcher
+MAX_PHOTO_SUGGESTIONS = 20
+MAX_MATCH_PHOTOS = 100
+
+# Print shops listed per page of the directory
+PRINTSHOP_PAGE_SIZE = 25
+
+# Staff listed per page of the print shop user list
+STAFF_PAGE_SIZE = 50
+
+# Most users offered by the staff user search
+USER_SEARCH_LIMIT = 20
+
 AUTH_USER_MODEL = 'user.User'
 
 LOGIN_URL = reverse_lazy('login')
@@ -25,6 +25,7 @@ urlpatterns = [
     path('pricelist/', include('pricelists.urls')),
     path('printshop/', include('printshops.urls')),
     path('admin/', admin.site.urls),
+    path('api/', include('printshops.api_urls')),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('user/', include('user.urls')),
 ]
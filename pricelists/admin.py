@@ -1,3 +1,34 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-# Register your models here.
+from .models import (CurrentPrice, PriceHistoryCompaction, PriceList, PriceListCurrency, PriceListCurrencyRate,
+                     PriceListProduct, PriceListProductPrice)
+from .rates import apply_rates, feed_file, read_feed
+
+
+class PriceListCurrencyAdmin(admin.ModelAdmin):
+    list_display = ('title', 'code', 'symbol', 'pricelist', 'base')
+    list_filter = ('code', 'base')
+    actions = ['load_feed_rates']
+
+    # Apply the newest local rate feed to the selected currencies
+    def load_feed_rates(self, request, queryset):
+        try:
+            path = feed_file()
+            rates = read_feed(path)
+        except (OSError, SyntaxError, ValueError) as error:
+            self.message_user(request, 'Could not read the rate feed: {}'.format(error), messages.ERROR)
+            return
+
+        result = apply_rates(rates, currencies=queryset)
+        self.message_user(request, '{} currencies updated in {} pricelists, {} unchanged, {} skipped.'.format(
+                          result['updated'], len(result['pricelists']), result['unchanged'], result['skipped']))
+    load_feed_rates.short_description = 'Load rates from the local feed'
+
+
+admin.site.register(PriceList)
+admin.site.register(PriceListCurrency, PriceListCurrencyAdmin)
+admin.site.register(PriceListCurrencyRate)
+admin.site.register(PriceListProduct)
+admin.site.register(PriceListProductPrice)
+admin.site.register(CurrentPrice)
+admin.site.register(PriceHistoryCompaction)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PricelistsConfig(AppConfig):
     name = 'pricelists'
+
+    """ Register our signals """
+    def ready(self):
+        import pricelists.signals
@@ -0,0 +1,92 @@
+from django.conf import settings
+
+from products.models import Product
+
+from .matrix import money, price_matrix
+
+import csv, io, json, os, time
+
+# Exports are kept as <PRICELIST_EXPORT_ROOT>/<pricelist>/<version>.<format>, outside the public media
+PRICELIST_EXPORT_ROOT = getattr(settings, 'PRICELIST_EXPORT_ROOT', os.path.join(settings.BASE_DIR, 'exports'))
+
+# Other versions are removed once this many seconds old, so requests still serving them can finish
+PRICELIST_EXPORT_MAX_AGE = getattr(settings, 'PRICELIST_EXPORT_MAX_AGE', 10 * 60)
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def render_json(pricelist, payload, titles):
+    currencies = [currency['code'] for currency in payload['currencies']]
+    data = {
+        'pricelist': pricelist.pk,
+        'title': pricelist.title,
+        'version': payload['version'],
+        'currencies': payload['currencies'],
+        'products': [{
+            'product': product,
+            'title': titles.get(product, ''),
+            'prices': {code: money(price) for code, price in zip(currencies, prices)},
+        } for product, prices in zip(payload['products'], payload['prices'])],
+    }
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def render_csv(pricelist, payload, titles):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['product', 'title'] + [currency['code'] for currency in payload['currencies']])
+    for product, prices in zip(payload['products'], payload['prices']):
+        writer.writerow([product, titles.get(product, '')] + [money(price) for price in prices])
+    return buffer.getvalue().encode()
+
+
+RENDERERS = {
+    'json': render_json,
+    'csv': render_csv,
+}
+
+
+"""Remove the exports of a pricelist in the format, other than keep, older than the maximum age"""
+def remove_stale(directory, format, keep):
+    cutoff = time.time() - PRICELIST_EXPORT_MAX_AGE
+    for name in os.listdir(directory):
+        if name.endswith('.' + format) and name != keep:
+            path = os.path.join(directory, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+"""Open export of the current version of a pricelist, and that version.
+
+The export is rendered from the price matrix once per pricelist version and
+format. It is opened before anything is removed, so it stays readable even
+when another process removes it. Stale versions are only looked for when a
+new one is written.
+"""
+def get_export(pricelist, format):
+    payload = price_matrix.payload(pricelist.pk)
+    directory = os.path.join(PRICELIST_EXPORT_ROOT, str(pricelist.pk))
+    path = os.path.join(directory, '{}.{}'.format(payload['version'], format))
+    try:
+        return open(path, 'rb'), payload['version']
+    except FileNotFoundError:
+        pass
+
+    titles = dict(Product.objects.filter(pk__in=payload['products']).values_list('pk', 'title'))
+    data = RENDERERS[format](pricelist, payload, titles)
+
+    os.makedirs(directory, exist_ok=True)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+    export = open(path, 'rb')
+    remove_stale(directory, format, os.path.basename(path))
+    return export, payload['version']
@@ -1,4 +1,5 @@
 from django import forms
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from decimal import Decimal
@@ -7,17 +8,34 @@ from products.models import Product
 
 from .models import PriceList, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
 
+"""Optional date a new price or rate takes effect, now when left empty"""
+class EffectiveField(forms.DateTimeField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('required', False)
+        kwargs.setdefault('label', _('Effective from'))
+        kwargs.setdefault('help_text', _('Leave empty to apply the change now.'))
+        super(EffectiveField, self).__init__(*args, **kwargs)
+
+    def validate(self, value):
+        super(EffectiveField, self).validate(value)
+        if value and value < timezone.now():
+            raise forms.ValidationError(_('Changes can only be scheduled for the future.'))
+
+
 """Pricelist Currency create/edit"""
 class PriceListCurrencyForm(forms.ModelForm):
     baserate = forms.DecimalField(max_digits=16, decimal_places=8,
                               initial=Decimal('1.00'), required=True,
                               label=_('Rate to Base Currency'))
+    effective = EffectiveField()
 
-    # Disable the base rate if base currency
+    # Disable the base rate if base currency, only existing currencies can schedule a rate
     def __init__(self, *args, **kwargs):
         super(PriceListCurrencyForm, self).__init__(*args, **kwargs)
         if self.instance.base:
             self.fields['baserate'].disabled = True
+        if self.instance.base or not self.instance.pk:
+            del self.fields['effective']
 
     class Meta:
         model = PriceListCurrency
@@ -62,6 +80,7 @@ class PriceListProductEditForm(forms.ModelForm):
     baseprice = forms.DecimalField(max_digits=8, decimal_places=2,
                               initial=Decimal('0.00'), required=True,
                               label=_('Base Price'))
+    effective = EffectiveField()
 
     class Meta:
         model = PriceListProduct
@@ -70,3 +89,11 @@ class PriceListProductEditForm(forms.ModelForm):
             'pricelist': forms.HiddenInput,
             'product': forms.HiddenInput,
         }
+
+
+"""Pricelist Product price import"""
+class ImportPricesForm(forms.Form):
+    file = forms.FileField(label=_('CSV file'),
+                           help_text=_('Columns: product or title, price and optionally effective.'))
+    effective = EffectiveField()
+    partial = forms.BooleanField(required=False, label=_('Import the valid rows even if some rows have errors'))
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import PriceHistoryCompaction, PriceListCurrencyRate, PriceListProductPrice
+
+import gzip, json, os
+
+# Price and rate history older than this many days is folded into the row in effect at the cutoff
+PRICE_HISTORY_RETENTION_DAYS = getattr(settings, 'PRICE_HISTORY_RETENTION_DAYS', 365)
+
+# Directory the compacted rows are archived to as gzipped JSON lines
+PRICE_HISTORY_ARCHIVE = getattr(settings, 'PRICE_HISTORY_ARCHIVE', os.path.join(settings.BASE_DIR, 'archive'))
+
+# History tables as (model, owner field, value field)
+HISTORIES = (
+    (PriceListProductPrice, 'listproduct', 'price'),
+    (PriceListCurrencyRate, 'currency', 'rate'),
+)
+
+# Owners, i.e. pricelist products or currencies, whose history is compacted at a time
+OWNERS_PER_PAGE = 500
+
+# Rows deleted by one statement, well under the bound parameter limits of the databases
+DELETE_BATCH_SIZE = 500
+
+
+"""Rows of a history table that can go without changing any as-of lookup.
+
+rows are (pk, owner pk, value, date_effective) ordered by owner and date. Of
+the rows effective at or before the cutoff only the last one is kept, as it
+is the value in effect at the cutoff, so lookups at or after the cutoff stay
+correct. Rows after the cutoff are kept as they are.
+"""
+def compactable(rows, cutoff):
+    current = None
+    pending = None
+    for row in rows:
+        pk, key, value, date_effective = row
+        if key != current:
+            current, pending = key, None
+        if date_effective <= cutoff:
+            if pending is not None:
+                yield pending
+            pending = row
+
+
+# History rows of a page of owners at a time, so no cursor is open while rows are deleted
+def history_pages(model, owner, field):
+    last = 0
+    while True:
+        owners = list(model.objects.filter(**{owner + '__gt': last}).order_by(owner)
+                      .values_list(owner, flat=True).distinct()[:OWNERS_PER_PAGE])
+        if not owners:
+            return
+        yield list(model.objects.filter(**{owner + '__in': owners}).order_by(owner, 'date_effective', 'pk')
+                   .values_list('pk', owner, field, 'date_effective'))
+        last = owners[-1]
+
+
+def archive_row(model, row):
+    pk, key, value, date_effective = row
+    return json.dumps({
+        'model': model._meta.label_lower,
+        'pk': pk,
+        'owner': key,
+        'value': str(value),
+        'date_effective': date_effective.isoformat(),
+    }) + '\n'
+
+
+def delete_rows(model, pks):
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Compaction never changes a current price, so skip the per row delete signals
+        for i in range(0, len(pks), DELETE_BATCH_SIZE):
+            batch = pks[i:i + DELETE_BATCH_SIZE]
+            cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+                           connection.ops.quote_name(model._meta.db_table),
+                           connection.ops.quote_name(model._meta.pk.column),
+                           ', '.join(['%s'] * len(batch))), batch)
+
+
+"""Compact the price and rate histories up to cutoff.
+
+Unless dry_run is set, the compactable rows are appended to the archive
+file, when one is given, before they are deleted, and the compaction is
+recorded so lookups before the cutoff are refused. Returns
+{model label: rows reclaimed}.
+"""
+def compact(cutoff, archive=None, dry_run=False):
+    reclaimed = {}
+    out = gzip.open(archive, 'at') if archive and not dry_run else None
+    try:
+        for model, owner, field in HISTORIES:
+            reclaimed[model._meta.label] = 0
+            for rows in history_pages(model, owner, field):
+                rows = list(compactable(rows, cutoff))
+                reclaimed[model._meta.label] += len(rows)
+                if dry_run or not rows:
+                    continue
+                if out is not None:
+                    out.writelines(archive_row(model, row) for row in rows)
+                    out.flush()
+                delete_rows(model, [row[0] for row in rows])
+    finally:
+        if out is not None:
+            out.close()
+
+    if not dry_run and any(reclaimed.values()):
+        PriceHistoryCompaction.objects.create(cutoff=cutoff, archive=archive or '', rows=sum(reclaimed.values()))
+    return reclaimed
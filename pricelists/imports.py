@@ -0,0 +1,170 @@
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import PriceListProduct, PriceListProductPrice
+from .pricecache import price_cache
+from .projection import refresh
+from .prices import current_prices
+
+from decimal import Decimal, InvalidOperation
+import csv, time
+
+# Rows inserted per bulk_create statement
+BATCH_SIZE = 2000
+
+# Products refreshed in the projection at a time, their pks are bound parameters
+REFRESH_BATCH_SIZE = 500
+
+PRICE_FIELD = PriceListProductPrice._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places)
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.unchanged = 0
+        self.errors = []
+        self.unreadable = False
+        self.seconds = 0
+
+    @property
+    def rate(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+# Rows of the CSV reader, stopping with an error at the first line that can't be read
+def read_rows(reader, result):
+    try:
+        yield from reader
+    except csv.Error as error:
+        result.error(reader.line_num + 1, 'The line can not be read as CSV: {}'.format(error))
+        result.unreadable = True
+    except UnicodeDecodeError:
+        result.error(reader.line_num + 1, 'The file is not UTF-8 encoded')
+        result.unreadable = True
+
+
+def parse_price(value):
+    try:
+        price = Decimal(value.strip())
+    except (InvalidOperation, AttributeError):
+        raise ValueError('"{}" is not a price'.format(value))
+    if not price.is_finite() or price < 0 or price >= MAX_PRICE:
+        raise ValueError('Price {} is out of range'.format(value))
+    if price.as_tuple().exponent < -PRICE_FIELD.decimal_places:
+        raise ValueError('Price {} has more than {} decimal places'.format(value, PRICE_FIELD.decimal_places))
+    return price
+
+
+def parse_effective(value, now):
+    value = (value or '').strip()
+    if not value:
+        return None
+    effective = parse_datetime(value)
+    if effective is None:
+        raise ValueError('"{}" is not a date and time'.format(value))
+    if timezone.is_naive(effective):
+        effective = timezone.make_aware(effective)
+    if effective < now:
+        raise ValueError('Prices can only be scheduled for the future')
+    return effective
+
+
+"""Import base prices for the products of a pricelist from CSV text.
+
+lines is any iterable of CSV lines with a header row holding a product column
+(the product pk) or a title column, a price column and an optional effective
+column. Rows are validated against the pricelist's products and streamed into
+PriceListProductPrice with bulk_create inside one transaction, skipping prices
+that are already in effect. Any error rolls the whole import back unless
+partial is set, in which case only the valid rows are written. A file that
+can't be read to the end is always rolled back.
+"""
+def import_prices(pricelist, lines, effective=None, partial=False):
+    result = ImportResult()
+    started = time.time()
+    now = timezone.now()
+    effective = effective or now
+
+    by_pk = {}
+    by_title = {}
+    for listproduct, product, title in (PriceListProduct.objects.filter(pricelist=pricelist)
+                                        .values_list('pk', 'product', 'product__title')):
+        by_pk[str(product)] = (listproduct, product)
+        by_title[title.strip().lower()] = None if title.strip().lower() in by_title else (listproduct, product)
+    current = {product: price for (list_pk, product), price in current_prices([pricelist], now).items()}
+
+    reader = csv.DictReader(lines)
+    try:
+        fields = [field.strip().lower() for field in reader.fieldnames or ()]
+    except (csv.Error, UnicodeDecodeError):
+        result.error(1, 'The file can not be read, it must be UTF-8 encoded CSV')
+        result.unreadable = True
+        return result
+    if 'price' not in fields or not ('product' in fields or 'title' in fields):
+        result.error(1, 'The header needs a price column and a product or title column')
+        return result
+    reader.fieldnames = fields
+
+    seen = set()
+    batch = []
+    changed = []
+    with transaction.atomic():
+        for row in read_rows(reader, result):
+            result.rows += 1
+            line = reader.line_num
+            try:
+                if row.get('product'):
+                    match = by_pk.get(row['product'].strip())
+                    if match is None:
+                        raise ValueError('Product {} is not in this pricelist'.format(row['product']))
+                else:
+                    title = (row.get('title') or '').strip().lower()
+                    if title not in by_title:
+                        raise ValueError('Product "{}" is not in this pricelist'.format(row.get('title')))
+                    match = by_title[title]
+                    if match is None:
+                        raise ValueError('Title "{}" matches several products, use the product column'.format(row['title']))
+                listproduct, product = match
+                if listproduct in seen:
+                    raise ValueError('Product {} appears more than once'.format(product))
+                seen.add(listproduct)
+
+                price = parse_price(row['price'])
+                date_effective = parse_effective(row.get('effective'), now) or effective
+            except ValueError as error:
+                result.error(line, str(error))
+                continue
+
+            if date_effective == now and current.get(product) == price:
+                result.unchanged += 1
+                continue
+
+            batch.append(PriceListProductPrice(listproduct_id=listproduct, price=price,
+                                               date_effective=date_effective))
+            changed.append(product)
+            if len(batch) >= BATCH_SIZE:
+                result.created += len(PriceListProductPrice.objects.bulk_create(batch))
+                batch = []
+
+        if batch:
+            result.created += len(PriceListProductPrice.objects.bulk_create(batch))
+
+        if result.unreadable or (result.errors and not partial):
+            transaction.set_rollback(True)
+            result.created = 0
+        else:
+            for i in range(0, len(changed), REFRESH_BATCH_SIZE):
+                refresh(pricelist, products=changed[i:i + REFRESH_BATCH_SIZE])
+
+    # bulk_create sends no signals, invalidate the pricelist once
+    if result.created:
+        price_cache.invalidate_on_commit(pricelist.pk)
+
+    result.seconds = time.time() - started
+    return result
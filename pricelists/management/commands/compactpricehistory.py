@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from pricelists.history import PRICE_HISTORY_ARCHIVE, PRICE_HISTORY_RETENTION_DAYS, compact
+
+from datetime import timedelta
+import os
+
+
+class Command(BaseCommand):
+    help = 'Fold price and rate history older than the retention period into the rows in effect at the cutoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=PRICE_HISTORY_RETENTION_DAYS,
+                            help='History newer than this many days is kept as is')
+        parser.add_argument('--archive', default=PRICE_HISTORY_ARCHIVE,
+                            help='Directory the removed rows are archived to, PRICE_HISTORY_ARCHIVE by default')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Delete the removed rows without archiving them')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the rows that would be removed without removing them')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days can not be negative')
+        now = timezone.now()
+        cutoff = now - timedelta(days=options['days'])
+
+        archive = None
+        if not options['no_archive'] and not options['dry_run']:
+            try:
+                os.makedirs(options['archive'], exist_ok=True)
+            except OSError as error:
+                raise CommandError(error)
+            archive = os.path.join(options['archive'], 'pricehistory-{}.jsonl.gz'.format(now.strftime('%Y%m%d%H%M%S')))
+
+        reclaimed = compact(cutoff, archive=archive, dry_run=options['dry_run'])
+        for label, rows in reclaimed.items():
+            self.stdout.write('{}: {} rows {}'.format(label, rows, 'to remove' if options['dry_run'] else 'removed'))
+        if archive and any(reclaimed.values()):
+            self.stdout.write('Archived to {}'.format(archive))
+        self.stdout.write(self.style.SUCCESS('History before {} compacted'.format(cutoff.isoformat())))
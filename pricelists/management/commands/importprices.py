@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from pricelists.imports import import_prices
+from pricelists.models import PriceList
+
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Import base prices for the products of a pricelist from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pricelist', type=int,
+                            help='Pricelist pk')
+        parser.add_argument('file',
+                            help='CSV file with product or title, price and optional effective columns, - for stdin')
+        parser.add_argument('--effective',
+                            help='Date and time the prices take effect, now by default')
+        parser.add_argument('--partial', action='store_true',
+                            help='Write the valid rows even if some rows have errors')
+
+    def handle(self, *args, **options):
+        try:
+            pricelist = PriceList.objects.get(pk=options['pricelist'])
+        except PriceList.DoesNotExist:
+            raise CommandError('Pricelist {} does not exist'.format(options['pricelist']))
+
+        effective = None
+        if options['effective']:
+            effective = parse_datetime(options['effective'])
+            if effective is None:
+                raise CommandError('"{}" is not a date and time'.format(options['effective']))
+            if timezone.is_naive(effective):
+                effective = timezone.make_aware(effective)
+
+        if options['file'] == '-':
+            result = import_prices(pricelist, sys.stdin, effective, options['partial'])
+        else:
+            try:
+                with open(options['file'], newline='', encoding='utf-8-sig') as f:
+                    result = import_prices(pricelist, f, effective, options['partial'])
+            except FileNotFoundError:
+                raise CommandError('{} does not exist'.format(options['file']))
+
+        for line, message in result.errors:
+            self.stderr.write('Line {}: {}'.format(line, message))
+
+        summary = '{} rows in {:.2f}s ({:.0f} rows/s): {} prices created, {} unchanged, {} errors'.format(
+                  result.rows, result.seconds, result.rate, result.created, result.unchanged, len(result.errors))
+        if result.unreadable or (result.errors and not options['partial']):
+            raise CommandError('Nothing imported. ' + summary)
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from pricelists.rates import RATE_FEED_BASE, apply_rates, feed_file, read_feed
+
+
+class Command(BaseCommand):
+    help = 'Apply a CSV or ECB style XML rate feed to every pricelist currency with a matching code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            help='Feed file, or directory whose newest feed is read, RATE_FEED_PATH by default')
+        parser.add_argument('--base', default=RATE_FEED_BASE,
+                            help='Currency the feed rates are quoted against')
+        parser.add_argument('--effective',
+                            help='Date and time the rates take effect, now by default')
+
+    def handle(self, *args, **options):
+        effective = None
+        if options['effective']:
+            effective = parse_datetime(options['effective'])
+            if effective is None:
+                raise CommandError('"{}" is not a date and time'.format(options['effective']))
+            if timezone.is_naive(effective):
+                effective = timezone.make_aware(effective)
+
+        try:
+            path = feed_file(options['path'])
+            rates = read_feed(path, options['base'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        except SyntaxError as error:
+            raise CommandError('{} is not valid XML: {}'.format(path, error))
+
+        result = apply_rates(rates, effective=effective)
+        self.stdout.write(self.style.SUCCESS(
+            'Read {} rates from {}: {} currencies updated in {} pricelists, {} unchanged, {} skipped'.format(
+            len(rates), path, result['updated'], len(result['pricelists']), result['unchanged'], result['skipped'])))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from pricelists.models import PriceList
+from pricelists.projection import refresh
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the current price table from the price and rate histories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pricelist', type=int, action='append', dest='pricelists',
+                            help='Only rebuild this pricelist, may be repeated')
+
+    def handle(self, *args, **options):
+        pricelists = PriceList.objects.order_by('pk')
+        if options['pricelists']:
+            pricelists = pricelists.filter(pk__in=options['pricelists'])
+
+        totals = {'created': 0, 'updated': 0, 'deleted': 0}
+        for pricelist in pricelists.values_list('pk', flat=True).iterator():
+            result = refresh(pricelist)
+            if any(result.values()) and options['verbosity'] > 1:
+                self.stdout.write('Pricelist {}: {created} created, {updated} updated, {deleted} deleted'.format(
+                                  pricelist, **result))
+            for key in totals:
+                totals[key] += result[key]
+
+        self.stdout.write(self.style.SUCCESS(
+            'Current prices rebuilt: {created} created, {updated} updated, {deleted} deleted'.format(**totals)))
@@ -0,0 +1,136 @@
+import numpy as np
+
+from .pricecache import price_cache
+
+from decimal import Decimal
+import threading
+
+# Every currency is priced in hundredths, the scale of PriceListProductPrice.price
+MINOR_UNITS = 100
+
+# Rates are held as integers in units of 1e-8, the scale of PriceListCurrencyRate.rate
+RATE_SCALE = 10 ** 8
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+"""Convert base prices to every currency.
+
+base is an array of prices in minor units and rates an array of rates in
+RATE_SCALE units. Returns the (len(base), len(rates)) matrix of prices in
+minor units, rounded half up, the only rounding in the conversion. Falls back
+to exact Python integers when int64 could overflow.
+"""
+def convert(base, rates):
+    base = np.asarray(base, dtype=np.int64)
+    rates = np.asarray(rates, dtype=np.int64)
+    if overflows(base, rates):
+        base, rates = base.astype(object), rates.astype(object)
+    return (np.multiply.outer(base, rates) * 2 + RATE_SCALE) // (2 * RATE_SCALE)
+
+
+def overflows(base, rates):
+    return bool(base.size and rates.size and int(base.max()) * int(rates.max()) * 2 + RATE_SCALE > INT64_MAX)
+
+
+def to_minor(price):
+    return int(price * MINOR_UNITS)
+
+
+def to_scaled(rate):
+    return int(rate * RATE_SCALE)
+
+
+# Decimal string of an amount in minor units
+def money(minor):
+    return str((Decimal(minor) / MINOR_UNITS).quantize(Decimal(1) / MINOR_UNITS))
+
+
+"""Products by currencies price matrix of every pricelist.
+
+Built from the resolved pricelists of the price cache. When a pricelist's
+version changes, only the rows of repriced products and the columns of
+changed rates are converted again, unless products or currencies were added
+or removed.
+"""
+class PriceMatrix:
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+        self.counters = {'builds': 0, 'updates': 0, 'rows': 0, 'columns': 0}
+
+    def build(self, entry):
+        products = sorted(entry['prices'])
+        codes = sorted(entry['rates'])
+        base = np.array([to_minor(entry['prices'][product]) for product in products], dtype=np.int64)
+        rates = np.array([to_scaled(entry['rates'][code]) for code in codes], dtype=np.int64)
+        self.counters['builds'] += 1
+        return {
+            'version': entry['version'],
+            'products': products,
+            'codes': codes,
+            'symbols': [entry['symbols'].get(code) for code in codes],
+            'base': base,
+            'rates': rates,
+            'matrix': convert(base, rates),
+        }
+
+    def update(self, state, entry):
+        if sorted(entry['prices']) != state['products'] or sorted(entry['rates']) != state['codes']:
+            return self.build(entry)
+
+        base = np.array([to_minor(entry['prices'][product]) for product in state['products']], dtype=np.int64)
+        rates = np.array([to_scaled(entry['rates'][code]) for code in state['codes']], dtype=np.int64)
+        rows = np.flatnonzero(base != state['base'])
+        columns = np.flatnonzero(rates != state['rates'])
+
+        # Readers may still hold the old matrix, and larger prices may need exact integers
+        matrix = state['matrix'].astype(object if overflows(base, rates) else state['matrix'].dtype)
+        if rows.size:
+            matrix[rows, :] = convert(base[rows], rates)
+        if columns.size:
+            matrix[:, columns] = convert(base, rates[columns])
+
+        self.counters['updates'] += 1
+        self.counters['rows'] += int(rows.size)
+        self.counters['columns'] += int(columns.size)
+        state = dict(state, version=entry['version'], symbols=[entry['symbols'].get(code) for code in state['codes']],
+                     base=base, rates=rates, matrix=matrix)
+        state.pop('payload', None)
+        return state
+
+    """Matrix state of the current version of the pricelist"""
+    def get(self, pricelist_id):
+        entry = price_cache.get(pricelist_id)
+        with self.lock:
+            state = self.states.get(pricelist_id)
+            if state is None:
+                state = self.build(entry)
+            elif state['version'] != entry['version']:
+                state = self.update(state, entry)
+            else:
+                return state
+            self.states[pricelist_id] = state
+        return state
+
+    """Compact payload of the pricelist, prices as rows of integer minor units per product"""
+    def payload(self, pricelist_id):
+        state = self.get(pricelist_id)
+        if 'payload' not in state:
+            state['payload'] = {
+                'pricelist': pricelist_id,
+                'version': state['version'],
+                'minor_units': MINOR_UNITS,
+                'currencies': [{'code': code, 'symbol': symbol}
+                               for code, symbol in zip(state['codes'], state['symbols'])],
+                'products': state['products'],
+                'prices': state['matrix'].tolist(),
+            }
+        return state['payload']
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pricelists=len(self.states))
+
+
+price_matrix = PriceMatrix()
@@ -1,17 +1,22 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from datetime import datetime
-import pytz
-
 User = get_user_model()
 
 from products.models import Product
 
 
+import uuid
+
+
+def new_cache_version():
+    return uuid.uuid4().hex
+
+
 """The PriceList Header"""
 class PriceList(models.Model):
     title = models.CharField(_('Title'), max_length=64, unique=True)
@@ -20,6 +25,8 @@ class PriceList(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True,
                               on_delete=models.SET_NULL)
     date_created = models.DateTimeField(_('Created'), auto_now_add=True)
+    # Replaced whenever the resolved prices change, see pricecache
+    cache_version = models.CharField(max_length=32, default=new_cache_version, editable=False)
 
     def __str__(self):
         return self.title
@@ -53,17 +60,31 @@ class PriceListCurrency(models.Model):
     def get_absolute_url(self):
         return reverse('edit_currency', args=[self.pk])
 
-    # Return the current currency rate
+    # Return the current currency rate, from the bulk annotation or the price cache
     def current_rate(self):
-        current = PriceListCurrencyRate.objects.filter(currency=self, date_effective__lt=datetime.now(pytz.utc)).order_by('date_effective').last()
-        return current.rate
+        from .pricecache import price_cache
+        from .prices import quantize
+        if not hasattr(self, 'resolved_rate'):
+            return price_cache.rate(self.pricelist_id, self.code)
+        return quantize(self.resolved_rate, 'rate')
 
 
 """Multi Currency Pricelist Rates"""
 class PriceListCurrencyRate(models.Model):
     currency = models.ForeignKey(PriceListCurrency, on_delete=models.CASCADE)
     rate = models.DecimalField(_('Rate to Base'), max_digits=16, decimal_places=8)
-    date_effective = models.DateTimeField(_('Effective'), auto_now_add=True)
+    date_effective = models.DateTimeField(_('Effective'), default=timezone.now)
+
+    # Rate at time T is a single seek on (currency, date_effective)
+    class Meta:
+        indexes = [
+            models.Index(fields=['currency', 'date_effective']),
+        ]
+
+    # The post_save signal refreshes the CurrentPrice projection, commit both or neither
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 
@@ -83,18 +104,76 @@ class PriceListProduct(models.Model):
     def get_absolute_url(self):
         return reverse('edit_pricelistproduct', args=[self.pk])
 
-    # Return the current product base price
+    # Return the current product base price, from the bulk annotation or the price cache
     def current_price(self):
-        currency = PriceListCurrency.objects.filter(pricelist=self.pricelist, base=True).first()
-        current = PriceListProductPrice.objects.filter(listproduct=self, date_effective__lt=datetime.now(pytz.utc)).order_by('date_effective').last()
-        return '{}{}'.format(currency.symbol, current.price)
+        from .pricecache import price_cache
+        from .prices import format_price
+        if not hasattr(self, 'resolved_price'):
+            entry = price_cache.get(self.pricelist_id)
+            return format_price(entry['symbol'], entry['prices'].get(self.product_id))
+        return format_price(self.resolved_symbol, self.resolved_price)
 
 
 """Assign prices to products of list"""
 class PriceListProductPrice(models.Model):
     listproduct = models.ForeignKey(PriceListProduct, on_delete=models.CASCADE)
     price = models.DecimalField(_('Price'), max_digits=8, decimal_places=2)
-    date_effective = models.DateTimeField(_('Effective'), auto_now_add=True)
+    date_effective = models.DateTimeField(_('Effective'), default=timezone.now)
+
+    # Price at time T is a single seek on (listproduct, date_effective)
+    class Meta:
+        indexes = [
+            models.Index(fields=['listproduct', 'date_effective']),
+        ]
+
+    # The post_save signal refreshes the CurrentPrice projection, commit both or neither
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return '{}: {}'.format(self.listproduct, self.price)
+
+
+"""Current price of each product of a pricelist in each of its currencies.
+
+A projection of the price and rate histories, which stay the source of truth.
+Kept up to date by pricelists.projection whenever a price or rate is added,
+and rebuilt by the rebuildcurrentprices command. valid_until is when the next
+scheduled price or rate comes into effect.
+"""
+class CurrentPrice(models.Model):
+    pricelist = models.ForeignKey(PriceList, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    currency = models.ForeignKey(PriceListCurrency, on_delete=models.CASCADE)
+    price = models.DecimalField(_('Price'), max_digits=24, decimal_places=2)
+    version = models.PositiveIntegerField(default=1)
+    valid_until = models.DateTimeField(blank=True, null=True)
+    date_updated = models.DateTimeField(_('Last Updated'), auto_now=True)
+
+    class Meta:
+        unique_together = ("pricelist", "product", "currency")
+        verbose_name = "Current Price"
+        verbose_name_plural = "Current Prices"
+
+    def __str__(self):
+        return '{} - {}: {} {}'.format(self.pricelist_id, self.product_id, self.currency_id, self.price)
+
+
+"""A compaction of the price and rate histories.
+
+Lookups at times before the latest cutoff can no longer be answered from the
+history tables, the removed rows are in the archive file.
+"""
+class PriceHistoryCompaction(models.Model):
+    cutoff = models.DateTimeField(_('Cutoff'))
+    archive = models.CharField(_('Archive'), max_length=255, blank=True)
+    rows = models.PositiveIntegerField(_('Rows Removed'))
+    date_added = models.DateTimeField(_('Compacted'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Price History Compaction"
+        verbose_name_plural = "Price History Compactions"
+
+    def __str__(self):
+        return '{}: {} rows'.format(self.cutoff, self.rows)
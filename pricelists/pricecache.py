@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PriceList, PriceListCurrency, PriceListProduct, new_cache_version
+from .prices import next_change, quantize, with_current_price, with_current_rate
+
+import threading, time
+
+# How long the Django cache keeps a resolved pricelist
+PRICE_CACHE_TIMEOUT = getattr(settings, 'PRICE_CACHE_TIMEOUT', 24 * 60 * 60)
+
+# How long a process trusts its own copy before checking the version again,
+# changes made by other processes show up within this many seconds
+PRICE_CACHE_CHECK = getattr(settings, 'PRICE_CACHE_CHECK', 5)
+
+
+"""Versioned cache of the resolved prices and rates of each pricelist.
+
+Every pricelist has a version token in its cache_version column, so every
+process sees the same version whatever the cache backend. A resolved
+pricelist is stored in the Django cache under its version, shared between
+processes when the backend is, and each process keeps its own copy in memory.
+Invalidating a pricelist replaces the token, so stale copies are simply never
+read again.
+"""
+class PriceCache:
+    def __init__(self, timeout=PRICE_CACHE_TIMEOUT, check=PRICE_CACHE_CHECK):
+        self.timeout = timeout
+        self.check = check
+        self.local = {}
+        self.lock = threading.Lock()
+        self.counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def entry_key(self, pricelist_id, version):
+        return 'pricelist:{}:{}'.format(pricelist_id, version)
+
+    def version(self, pricelist_id):
+        return PriceList.objects.filter(pk=pricelist_id).values_list('cache_version', flat=True).first()
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    """Resolved pricelist of the current version.
+
+    Returned as {'version', 'symbol', 'prices': {product pk: price},
+    'rates': {code: rate}, 'symbols': {code: symbol}, 'expires'}, where
+    expires is the timestamp of the next scheduled price or rate.
+    """
+    def get(self, pricelist_id):
+        entry = self.lookup(pricelist_id)
+        if entry['expires'] is not None and time.time() >= entry['expires']:
+            # A scheduled price or rate has come into effect
+            self.invalidate(pricelist_id)
+            entry = self.lookup(pricelist_id)
+        return entry
+
+    def lookup(self, pricelist_id):
+        now = time.time()
+        with self.lock:
+            entry, checked = self.local.get(pricelist_id, (None, 0))
+        if entry is not None and now - checked < self.check:
+            self.count('local_hits')
+            return entry
+
+        version = self.version(pricelist_id)
+        if entry is not None and entry['version'] == version:
+            self.count('local_hits')
+        else:
+            entry = cache.get(self.entry_key(pricelist_id, version))
+            if entry is not None:
+                self.count('shared_hits')
+            else:
+                self.count('misses')
+                entry = self.load(pricelist_id, version)
+                cache.set(self.entry_key(pricelist_id, version), entry, self.timeout)
+
+        with self.lock:
+            self.local[pricelist_id] = (entry, now)
+        return entry
+
+    def load(self, pricelist_id, version):
+        at = timezone.now()
+        products = with_current_price(PriceListProduct.objects.filter(pricelist=pricelist_id), at)
+        currencies = with_current_rate(PriceListCurrency.objects.filter(pricelist=pricelist_id), at)
+        expires = next_change(pricelist_id, at)
+        entry = {'version': version, 'symbol': None, 'prices': {}, 'rates': {}, 'symbols': {},
+                 'expires': expires.timestamp() if expires else None}
+        for product, price, symbol in products.values_list('product', 'resolved_price', 'resolved_symbol'):
+            entry['symbol'] = symbol
+            if price is not None:
+                entry['prices'][product] = quantize(price, 'price')
+        for code, symbol, rate in currencies.values_list('code', 'symbol', 'resolved_rate'):
+            entry['symbols'][code] = symbol
+            if rate is not None:
+                entry['rates'][code] = quantize(rate, 'rate')
+        return entry
+
+    def price(self, pricelist_id, product_id):
+        return self.get(pricelist_id)['prices'].get(product_id)
+
+    def rate(self, pricelist_id, code):
+        return self.get(pricelist_id)['rates'].get(code)
+
+    def invalidate(self, pricelist_id):
+        PriceList.objects.filter(pk=pricelist_id).update(cache_version=new_cache_version())
+        with self.lock:
+            self.local.pop(pricelist_id, None)
+        self.count('invalidations')
+
+    """Invalidate now and again once the transaction commits.
+
+    The second invalidation drops anything another process cached from the
+    database before the change became visible.
+    """
+    def invalidate_on_commit(self, pricelist_id):
+        self.invalidate(pricelist_id)
+        transaction.on_commit(lambda: self.invalidate(pricelist_id))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, pricelists=len(self.local))
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 3) if lookups else None
+        return stats
+
+
+price_cache = PriceCache()
@@ -0,0 +1,114 @@
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.utils import timezone
+
+from decimal import Decimal
+
+from .models import PriceHistoryCompaction, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
+
+
+"""Raised for lookups at a time whose history has been compacted into the archive"""
+class HistoryCompacted(ValueError):
+    pass
+
+
+"""Refuse lookups at the given time when history before it has been compacted.
+
+Lookups now and at later times are always answered, so only an explicit time
+costs a query.
+"""
+def check_history(at):
+    if at is None:
+        return
+    horizon = PriceHistoryCompaction.objects.aggregate(horizon=Max('cutoff'))['horizon']
+    if horizon is not None and at < horizon:
+        raise HistoryCompacted('Prices before {} have been compacted into the archive'.format(horizon.isoformat()))
+
+
+"""Subquery of the price of the outer PriceListProduct in effect at the given time"""
+def price_at(at=None):
+    return Subquery(PriceListProductPrice.objects
+                    .filter(listproduct=OuterRef('pk'), date_effective__lte=at or timezone.now())
+                    .order_by('-date_effective', '-pk').values('price')[:1],
+                    output_field=PriceListProductPrice._meta.get_field('price'))
+
+
+"""Subquery of the rate of the outer PriceListCurrency in effect at the given time"""
+def rate_at(at=None):
+    return Subquery(PriceListCurrencyRate.objects
+                    .filter(currency=OuterRef('pk'), date_effective__lte=at or timezone.now())
+                    .order_by('-date_effective', '-pk').values('rate')[:1],
+                    output_field=PriceListCurrencyRate._meta.get_field('rate'))
+
+
+def base_symbol():
+    return Subquery(PriceListCurrency.objects.filter(pricelist=OuterRef('pricelist'), base=True).values('symbol')[:1])
+
+
+"""Annotate PriceListProducts with resolved_price and resolved_symbol, the base price in effect"""
+def with_current_price(queryset, at=None):
+    return queryset.annotate(resolved_price=price_at(at), resolved_symbol=base_symbol())
+
+
+"""Annotate PriceListCurrencies with resolved_rate, the rate in effect"""
+def with_current_rate(queryset, at=None):
+    return queryset.annotate(resolved_rate=rate_at(at))
+
+
+"""Base price of every product of one or more pricelists in a single query.
+
+Returns {(pricelist pk, product pk): price}, products without a price in
+effect are left out.
+"""
+def current_prices(pricelists, at=None):
+    rows = (with_current_price(PriceListProduct.objects.filter(pricelist__in=pricelists), at)
+            .values_list('pricelist', 'product', 'resolved_price'))
+    return {(pricelist, product): quantize(price, 'price') for pricelist, product, price in rows if price is not None}
+
+
+"""Base price of one pricelist product at the given time, a seek on its (listproduct, date_effective) index.
+
+Raises HistoryCompacted for a time before the last compaction.
+"""
+def price_as_of(listproduct, at=None):
+    check_history(at)
+    price = (PriceListProductPrice.objects.filter(listproduct=listproduct, date_effective__lte=at or timezone.now())
+             .order_by('-date_effective', '-pk').values_list('price', flat=True).first())
+    return quantize(price, 'price')
+
+
+"""Rate of one currency at the given time, a seek on its (currency, date_effective) index.
+
+Raises HistoryCompacted for a time before the last compaction.
+"""
+def rate_as_of(currency, at=None):
+    check_history(at)
+    rate = (PriceListCurrencyRate.objects.filter(currency=currency, date_effective__lte=at or timezone.now())
+            .order_by('-date_effective', '-pk').values_list('rate', flat=True).first())
+    return quantize(rate, 'rate')
+
+
+"""Time of the next scheduled price or rate of the pricelist after the given time, or None"""
+def next_change(pricelist, at=None):
+    at = at or timezone.now()
+    changes = [
+        PriceListProductPrice.objects.filter(listproduct__pricelist=pricelist, date_effective__gt=at)
+                                     .aggregate(next=Min('date_effective'))['next'],
+        PriceListCurrencyRate.objects.filter(currency__pricelist=pricelist, date_effective__gt=at)
+                                     .aggregate(next=Min('date_effective'))['next'],
+    ]
+    changes = [change for change in changes if change is not None]
+    return min(changes) if changes else None
+
+
+# Annotated decimals lose their scale on some backends, restore the model's
+def quantize(value, field='price'):
+    if value is None:
+        return None
+    model = PriceListCurrencyRate if field == 'rate' else PriceListProductPrice
+    return Decimal(value).quantize(Decimal(1).scaleb(-model._meta.get_field(field).decimal_places))
+
+
+def format_price(symbol, price):
+    if price is None:
+        return ''
+    return '{}{}'.format(symbol or '', quantize(price))
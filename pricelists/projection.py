@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .matrix import MINOR_UNITS, convert, to_minor, to_scaled
+from .models import CurrentPrice, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
+from .prices import with_current_price, with_current_rate
+
+from decimal import Decimal
+
+
+def next_changes(queryset, key, at):
+    return dict(queryset.filter(date_effective__gt=at).values_list(key).annotate(next=Min('date_effective')))
+
+
+"""Bring the CurrentPrice rows of a pricelist in line with its histories.
+
+Only the given products and currencies (pks) are refreshed, all of them when
+left out, in which case rows of products and currencies no longer on the
+pricelist are removed too. Prices are converted with the rounding of the
+price matrix. Runs in one transaction with a fixed number of queries and
+returns the counts of created, updated and deleted rows.
+"""
+def refresh(pricelist, products=None, currencies=None, at=None):
+    at = at or timezone.now()
+    pricelist = getattr(pricelist, 'pk', pricelist)
+
+    listproducts = PriceListProduct.objects.filter(pricelist=pricelist)
+    listcurrencies = PriceListCurrency.objects.filter(pricelist=pricelist)
+    existing = CurrentPrice.objects.filter(pricelist=pricelist)
+    if products is not None:
+        listproducts = listproducts.filter(product__in=products)
+        existing = existing.filter(product__in=products)
+    if currencies is not None:
+        listcurrencies = listcurrencies.filter(pk__in=currencies)
+        existing = existing.filter(currency__in=currencies)
+
+    base = {product: price for product, price in
+            with_current_price(listproducts, at).values_list('product', 'resolved_price') if price is not None}
+    rates = {currency: rate for currency, rate in
+             with_current_rate(listcurrencies, at).values_list('pk', 'resolved_rate') if rate is not None}
+    product_changes = next_changes(PriceListProductPrice.objects.filter(listproduct__in=listproducts),
+                                   'listproduct__product', at)
+    rate_changes = next_changes(PriceListCurrencyRate.objects.filter(currency__in=listcurrencies), 'currency', at)
+
+    product_keys = sorted(base)
+    currency_keys = sorted(rates)
+    matrix = convert([to_minor(base[product]) for product in product_keys],
+                     [to_scaled(rates[currency]) for currency in currency_keys])
+
+    result = {'created': 0, 'updated': 0, 'deleted': 0}
+    with transaction.atomic():
+        rows = {(row.product_id, row.currency_id): row for row in existing.select_for_update()}
+        created = []
+        updated = []
+        for i, product in enumerate(product_keys):
+            for j, currency in enumerate(currency_keys):
+                price = Decimal(int(matrix[i, j])) / MINOR_UNITS
+                changes = [change for change in (product_changes.get(product), rate_changes.get(currency)) if change]
+                valid_until = min(changes) if changes else None
+
+                row = rows.pop((product, currency), None)
+                if row is None:
+                    created.append(CurrentPrice(pricelist_id=pricelist, product_id=product, currency_id=currency,
+                                                price=price, valid_until=valid_until))
+                elif row.price != price or row.valid_until != valid_until:
+                    row.version += 1
+                    row.price = price
+                    row.valid_until = valid_until
+                    row.date_updated = timezone.now()
+                    updated.append(row)
+
+        CurrentPrice.objects.bulk_create(created, batch_size=1000)
+        CurrentPrice.objects.bulk_update(updated, ['price', 'version', 'valid_until', 'date_updated'], batch_size=1000)
+        if rows:
+            CurrentPrice.objects.filter(pk__in=[row.pk for row in rows.values()]).delete()
+
+    result['created'], result['updated'], result['deleted'] = len(created), len(updated), len(rows)
+    return result
+
+
+"""Current price of a product in a currency of the pricelist, a single indexed lookup.
+
+Rows whose scheduled successor has come into effect are refreshed first.
+Returns the CurrentPrice, or None when the product has no price or the
+currency no rate.
+"""
+def current_price(pricelist, product, code):
+    query = CurrentPrice.objects.filter(pricelist=pricelist, product=product, currency__code=code.upper())
+    row = query.first()
+    if row is not None and row.valid_until is not None and row.valid_until <= timezone.now():
+        refresh(pricelist, products=[row.product_id], currencies=[row.currency_id])
+        row = query.first()
+    return row
+
+
+"""Current prices of many products on many pricelists, in one query.
+
+Returned as {(pricelist pk, product pk): {code: price}}. Like current_price,
+rows whose scheduled successor has come into effect are refreshed first.
+"""
+def current_prices(pricelists, products):
+    query = (CurrentPrice.objects.filter(pricelist__in=pricelists, product__in=products)
+             .values_list('pricelist', 'product', 'currency', 'currency__code', 'price', 'valid_until'))
+    rows = list(query)
+    now = timezone.now()
+    expired = {}
+    for pricelist, product, currency, code, price, valid_until in rows:
+        if valid_until is not None and valid_until <= now:
+            stale_products, stale_currencies = expired.setdefault(pricelist, (set(), set()))
+            stale_products.add(product)
+            stale_currencies.add(currency)
+    if expired:
+        for pricelist, (stale_products, stale_currencies) in expired.items():
+            refresh(pricelist, products=stale_products, currencies=stale_currencies, at=now)
+        rows = list(query.all())
+
+    result = {}
+    for pricelist, product, currency, code, price, valid_until in rows:
+        result.setdefault((pricelist, product), {})[code] = price
+    return result
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import PriceListCurrency, PriceListCurrencyRate
+from .pricecache import price_cache
+from .projection import refresh
+from .prices import quantize, with_current_rate
+
+from decimal import Decimal, InvalidOperation
+from xml.etree import ElementTree
+import csv, glob, os
+
+# Local file, or directory of feed files, read by the loadrates command and admin action
+RATE_FEED_PATH = getattr(settings, 'RATE_FEED_PATH', os.path.join(settings.BASE_DIR, 'rates'))
+
+# Currency the feed quotes its rates against, ECB reference rates are per euro
+RATE_FEED_BASE = getattr(settings, 'RATE_FEED_BASE', 'EUR')
+
+RATE_FIELD = PriceListCurrencyRate._meta.get_field('rate')
+MAX_RATE = Decimal(10) ** (RATE_FIELD.max_digits - RATE_FIELD.decimal_places)
+
+
+"""Newest .csv or .xml feed file at path, path itself when it is a file"""
+def feed_file(path=None):
+    path = path or RATE_FEED_PATH
+    if not os.path.isdir(path):
+        return path
+    files = glob.glob(os.path.join(path, '*.csv')) + glob.glob(os.path.join(path, '*.xml'))
+    if not files:
+        raise ValueError('No .csv or .xml rate feed in {}'.format(path))
+    return max(files, key=os.path.getmtime)
+
+
+def parse_rate(value):
+    try:
+        rate = Decimal(value.strip())
+    except (InvalidOperation, AttributeError):
+        raise ValueError('"{}" is not a rate'.format(value))
+    if not rate.is_finite() or rate <= 0:
+        raise ValueError('Rate {} is not positive'.format(value))
+    return rate
+
+
+"""Read a rate feed as {code: units of the currency per unit of the feed base}.
+
+CSV feeds have code and rate columns. XML feeds are read like the ECB daily
+reference rates, every element with currency and rate attributes is a rate.
+"""
+def read_feed(path, base=None):
+    rates = {(base or RATE_FEED_BASE).upper(): Decimal(1)}
+    if path.lower().endswith('.xml'):
+        for element in ElementTree.parse(path).iter():
+            if element.get('currency') and element.get('rate'):
+                rates[element.get('currency').strip().upper()] = parse_rate(element.get('rate'))
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            reader.fieldnames = [field.strip().lower() for field in reader.fieldnames or ()]
+            if 'code' not in reader.fieldnames or 'rate' not in reader.fieldnames:
+                raise ValueError('The header needs code and rate columns')
+            for row in reader:
+                try:
+                    rates[row['code'].strip().upper()] = parse_rate(row['rate'])
+                except ValueError as error:
+                    raise ValueError('Line {}: {}'.format(reader.line_num, error))
+    return rates
+
+
+"""Apply feed rates to every matching pricelist currency in one transaction.
+
+Each pricelist's rates are converted through its base currency, so a feed
+quoted in euro updates a pricelist based in dollars. Currencies whose rate
+is unchanged, and pricelists whose base currency is not in the feed, are
+skipped. Each changed pricelist is invalidated once. Returns the counts of
+updated, unchanged and skipped currencies and the changed currencies of
+each pricelist.
+"""
+def apply_rates(rates, currencies=None, effective=None):
+    now = timezone.now()
+    base_code = Subquery(PriceListCurrency.objects.filter(pricelist=OuterRef('pricelist'), base=True)
+                                                  .values('code')[:1])
+    currencies = PriceListCurrency.objects.all() if currencies is None else currencies
+    currencies = with_current_rate(currencies.filter(base=False, code__in=list(rates)), now) \
+                    .annotate(base_code=base_code) \
+                    .values_list('pk', 'pricelist', 'code', 'base_code', 'resolved_rate')
+
+    result = {'updated': 0, 'unchanged': 0, 'skipped': 0, 'pricelists': {}}
+    batch = []
+    for pk, pricelist, code, base, current in currencies:
+        if base not in rates:
+            result['skipped'] += 1
+            continue
+
+        rate = quantize(rates[code] / rates[base], 'rate')
+        if rate <= 0 or rate >= MAX_RATE:
+            result['skipped'] += 1
+        elif current is not None and quantize(current, 'rate') == rate:
+            result['unchanged'] += 1
+        else:
+            batch.append(PriceListCurrencyRate(currency_id=pk, rate=rate, date_effective=effective or now))
+            result['pricelists'].setdefault(pricelist, []).append(pk)
+
+    with transaction.atomic():
+        PriceListCurrencyRate.objects.bulk_create(batch, batch_size=1000)
+        result['updated'] = len(batch)
+
+        # bulk_create sends no signals, refresh and invalidate each changed pricelist once
+        for pricelist, changed in result['pricelists'].items():
+            refresh(pricelist, currencies=changed)
+            price_cache.invalidate_on_commit(pricelist)
+    return result
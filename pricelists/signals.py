@@ -0,0 +1,54 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import Product
+
+from .models import CurrentPrice, PriceList, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
+from .pricecache import price_cache
+from .projection import refresh
+
+
+# Products and currencies belong to the pricelist directly
+@receiver(post_save,sender=PriceListProduct)
+@receiver(post_delete,sender=PriceListProduct)
+@receiver(post_save,sender=PriceListCurrency)
+@receiver(post_delete,sender=PriceListCurrency)
+def invalidate_pricelist(sender, instance, **kwargs):
+    price_cache.invalidate_on_commit(instance.pricelist_id)
+
+# Exports carry the pricelist title and the product titles. Saving a stale
+# instance also writes back its old cache_version, which this replaces.
+@receiver(post_save,sender=PriceList)
+def invalidate_header(sender, instance, created, **kwargs):
+    if not created:
+        price_cache.invalidate_on_commit(instance.pk)
+
+@receiver(post_save,sender=Product)
+def invalidate_product_title(sender, instance, created, **kwargs):
+    if not created:
+        for pricelist in PriceListProduct.objects.filter(product=instance).values_list('pricelist', flat=True):
+            price_cache.invalidate_on_commit(pricelist)
+
+# Drop the current prices of a product taken off the pricelist
+@receiver(post_delete,sender=PriceListProduct)
+def delete_current_prices(sender, instance, **kwargs):
+    CurrentPrice.objects.filter(pricelist=instance.pricelist_id, product=instance.product_id).delete()
+
+# Refresh the current prices of the product, whose pricelist may already be deleted
+@receiver(post_save,sender=PriceListProductPrice)
+@receiver(post_delete,sender=PriceListProductPrice)
+def price_changed(sender, instance, **kwargs):
+    listproduct = PriceListProduct.objects.filter(pk=instance.listproduct_id).values_list('pricelist', 'product').first()
+    if listproduct is not None:
+        pricelist, product = listproduct
+        refresh(pricelist, products=[product])
+        price_cache.invalidate_on_commit(pricelist)
+
+# Refresh the current prices in the currency, whose pricelist may already be deleted
+@receiver(post_save,sender=PriceListCurrencyRate)
+@receiver(post_delete,sender=PriceListCurrencyRate)
+def rate_changed(sender, instance, **kwargs):
+    pricelist = PriceListCurrency.objects.filter(pk=instance.currency_id).values_list('pricelist', flat=True).first()
+    if pricelist is not None:
+        refresh(pricelist, currencies=[instance.currency_id])
+        price_cache.invalidate_on_commit(pricelist)
@@ -1,3 +1,429 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from rest_framework import status
+
+from products.models import Product
+
+from . import exports, history, imports, matrix, pricecache, prices, projection, rates, signals
+from .models import CurrentPrice, PriceList, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
+from .pricecache import price_cache
+
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import csv, gzip, io, json, os, tempfile
+
+User = get_user_model()
+
+
+class PriceTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.loginEmail = 'prices@frog.com'
+        self.loginPassword = 'Prices123'
+        self.user = User.objects.create_user(email=self.loginEmail, name='Price User',
+                                             password=self.loginPassword)
+        self.pricelist = PriceList.objects.create(title='Retail', description='Retail prices',
+                                                  active=True, owner=self.user)
+        self.base = PriceListCurrency.objects.create(pricelist=self.pricelist, title='BASE',
+                                                     code='USD', symbol='$', base=True)
+        PriceListCurrencyRate.objects.create(currency=self.base, rate=Decimal('1.00'))
+
+    def addProduct(self, title, *history, pricelist=None):
+        product = Product.objects.create(title=title, description=title, owner=self.user)
+        listproduct = PriceListProduct.objects.create(pricelist=pricelist or self.pricelist, product=product)
+        for age, price in history:
+            row = PriceListProductPrice.objects.create(listproduct=listproduct, price=Decimal(price))
+            PriceListProductPrice.objects.filter(pk=row.pk).update(
+                                    date_effective=timezone.now() - timedelta(days=age))
+        return listproduct
+
+    def testCurrentPrices(self):
+        """The latest price in effect wins, future prices are ignored"""
+        photo = self.addProduct('Photo', (10, '1.00'), (2, '1.50'), (-3, '9.99'))
+        canvas = self.addProduct('Canvas', (1, '20.00'))
+        self.addProduct('Unpriced')
+
+        other = PriceList.objects.create(title='Wholesale', description='Wholesale prices', owner=self.user)
+        bulk = self.addProduct('Bulk', (1, '0.50'), pricelist=other)
+
+        with self.assertNumQueries(1):
+            current = prices.current_prices([self.pricelist, other])
+        self.assertEqual(current, {
+            (self.pricelist.pk, photo.product_id): Decimal('1.50'),
+            (self.pricelist.pk, canvas.product_id): Decimal('20.00'),
+            (other.pk, bulk.product_id): Decimal('0.50'),
+        })
+
+        """Prices in effect at an earlier time"""
+        earlier = prices.current_prices([self.pricelist], at=timezone.now() - timedelta(days=5))
+        self.assertEqual(earlier, {(self.pricelist.pk, photo.product_id): Decimal('1.00')})
+
+        """The model method formats the price with the base symbol"""
+        self.assertEqual(photo.current_price(), '$1.50')
+        self.assertEqual(self.base.current_rate(), Decimal('1.00'))
+
+    def testDetailQueries(self):
+        """Rendering the pricelist costs the same number of queries for any number of products"""
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        url = reverse('detailed_pricelist', args=[self.pricelist.pk])
+
+        self.addProduct('Photo', (1, '1.50'))
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, '$1.50')
+
+        for i in range(10):
+            self.addProduct('Print {}'.format(i), (1, '2.00'))
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertContains(response, '$2.00', count=10)
+        self.assertEqual(len(many), len(few))
+
+    def testPriceCache(self):
+        """Resolved prices are loaded once and served from memory"""
+        photo = self.addProduct('Photo', (1, '1.50'))
+        photo = PriceListProduct.objects.get(pk=photo.pk)
+        misses = price_cache.stats()['misses']
+        with self.assertNumQueries(5):
+            self.assertEqual(photo.current_price(), '$1.50')
+        with self.assertNumQueries(0):
+            self.assertEqual(photo.current_price(), '$1.50')
+            self.assertEqual(self.base.current_rate(), Decimal('1.00000000'))
+        self.assertEqual(price_cache.stats()['misses'], misses + 1)
+
+        """A new price or rate invalidates the pricelist"""
+        PriceListProductPrice.objects.create(listproduct=photo, price=Decimal('1.75'))
+        self.assertEqual(photo.current_price(), '$1.75')
+        PriceListCurrencyRate.objects.create(currency=self.base, rate=Decimal('1.10'))
+        self.assertEqual(self.base.current_rate(), Decimal('1.10000000'))
+
+        """Deleting the product drops its price"""
+        photo.delete()
+        self.assertIsNone(price_cache.price(self.pricelist.pk, photo.product_id))
+        self.assertEqual(price_cache.stats()['misses'], misses + 4)
+
+        """Invalidations made by another process, with its own cache, are seen"""
+        web = pricecache.PriceCache(check=0)
+        photo = self.addProduct('Print', (1, '1.00'))
+        self.assertEqual(web.price(self.pricelist.pk, photo.product_id), Decimal('1.00'))
+        with mock.patch.object(pricecache, 'cache', LocMemCache('other-process', {})):
+            PriceListProductPrice.objects.bulk_create([PriceListProductPrice(listproduct=photo, price=Decimal('9.99'))])
+            pricecache.PriceCache().invalidate(self.pricelist.pk)
+        self.assertEqual(web.price(self.pricelist.pk, photo.product_id), Decimal('9.99'))
+
+    def testPriceMatrix(self):
+        """Prices are converted to every currency in minor units, rounded half up"""
+        self.assertEqual(matrix.convert([125, 100], [5 * 10 ** 7, 10 ** 8]).tolist(), [[63, 125], [50, 100]])
+        self.assertEqual(matrix.convert([99999999], [10 ** 16 - 1])[0, 0], 9999999899999999)
+
+        zar = PriceListCurrency.objects.create(pricelist=self.pricelist, title='Rand', code='ZAR', symbol='R')
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('14.5'))
+        photo = self.addProduct('Photo', (1, '1.50'))
+        canvas = self.addProduct('Canvas', (1, '20.00'))
+
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        response = self.client.get(reverse('pricelist_matrix', args=[self.pricelist.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        payload = response.json()
+        self.assertEqual([currency['code'] for currency in payload['currencies']], ['USD', 'ZAR'])
+        self.assertEqual(payload['products'], sorted([photo.product_id, canvas.product_id]))
+        rows = dict(zip(payload['products'], payload['prices']))
+        self.assertEqual(rows[photo.product_id], [150, 2175])
+        self.assertEqual(rows[canvas.product_id], [2000, 29000])
+
+        """Other users can't read the matrix, even of an active pricelist"""
+        User.objects.create_user(email='other@frog.com', name='Other User', password=self.loginPassword)
+        self.client.login(email='other@frog.com', password=self.loginPassword)
+        response = self.client.get(reverse('pricelist_matrix', args=[self.pricelist.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        """A new rate only converts its column again"""
+        stats = matrix.price_matrix.stats()
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('15'))
+        rows = dict(zip(payload['products'], matrix.price_matrix.payload(self.pricelist.pk)['prices']))
+        self.assertEqual(rows[photo.product_id], [150, 2250])
+        after = matrix.price_matrix.stats()
+        self.assertEqual((after['builds'], after['updates']), (stats['builds'], stats['updates'] + 1))
+        self.assertEqual((after['rows'], after['columns']), (stats['rows'], stats['columns'] + 1))
+
+    def testScheduledPrices(self):
+        """A price can be scheduled from the edit form, never backdated"""
+        photo = self.addProduct('Photo', (1, '1.50'))
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        url = reverse('edit_pricelistproduct', args=[photo.pk])
+        data = {'pricelist': self.pricelist.pk, 'product': photo.product_id, 'baseprice': '1.80'}
+
+        response = self.client.post(url, dict(data, effective='2001-01-01 00:00'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFormError(response, 'form', 'effective', 'Changes can only be scheduled for the future.')
+
+        start = timezone.now() + timedelta(days=2)
+        response = self.client.post(url, dict(data, effective=timezone.localtime(start).strftime('%Y-%m-%d %H:%M:%S')))
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+
+        """As-of lookups see the price from its effective date"""
+        self.assertEqual(prices.price_as_of(photo), Decimal('1.50'))
+        self.assertEqual(prices.price_as_of(photo, start + timedelta(minutes=1)), Decimal('1.80'))
+        self.assertEqual(prices.next_change(self.pricelist).replace(microsecond=0), start.replace(microsecond=0))
+        response = self.client.get(reverse('detailed_pricelist', args=[self.pricelist.pk]),
+                                   {'at': (start + timedelta(days=1)).date().isoformat()})
+        self.assertContains(response, '$1.80')
+
+        """The cached price switches over once the scheduled price is in effect"""
+        photo = PriceListProduct.objects.get(pk=photo.pk)
+        self.assertEqual(photo.current_price(), '$1.50')
+        later = start + timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=later), \
+             mock.patch('time.time', return_value=later.timestamp()):
+            self.assertEqual(photo.current_price(), '$1.80')
+            self.assertIsNone(price_cache.get(self.pricelist.pk)['expires'])
+
+    def testImportPrices(self):
+        """Valid rows are bulk inserted, unchanged prices skipped"""
+        photo = self.addProduct('Photo', (1, '1.50'))
+        canvas = self.addProduct('Canvas', (1, '20.00'))
+        self.addProduct('Mug', (1, '5.00'))
+        lines = ['product,price', '{},1.75'.format(photo.product_id), '{},20.00'.format(canvas.product_id)]
+        with self.assertNumQueries(14):
+            result = imports.import_prices(self.pricelist, lines)
+        self.assertEqual((result.rows, result.created, result.unchanged, result.errors), (2, 1, 1, []))
+        self.assertEqual(PriceListProduct.objects.get(pk=photo.pk).current_price(), '$1.75')
+
+        """Any error rolls the whole file back unless partial"""
+        lines = ['Title,Price', 'canvas,21.00', 'Unknown,1.00', 'Mug,1.234', 'Canvas,22.00']
+        result = imports.import_prices(self.pricelist, lines)
+        self.assertEqual(result.created, 0)
+        self.assertEqual([line for line, message in result.errors], [3, 4, 5])
+        self.assertEqual(prices.price_as_of(canvas), Decimal('20.00'))
+        result = imports.import_prices(self.pricelist, lines, partial=True)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(prices.price_as_of(canvas), Decimal('21.00'))
+
+        """The projection is refreshed a batch of products at a time"""
+        lines = ['title,price', 'Photo,1.80', 'Canvas,21.50', 'Mug,5.50']
+        with mock.patch.object(imports, 'REFRESH_BATCH_SIZE', 2), \
+                mock.patch.object(imports, 'refresh', wraps=imports.refresh) as refresh:
+            self.assertEqual(imports.import_prices(self.pricelist, lines).created, 3)
+        self.assertEqual([len(call[1]['products']) for call in refresh.call_args_list], [2, 1])
+        self.assertEqual(projection.current_price(self.pricelist, canvas.product_id, 'USD').price, Decimal('21.50'))
+
+        """Lines that can't be read as CSV roll back even a partial import"""
+        lines = ['title,price', 'Photo,1.90', 'Mug,"{}"'.format('9' * (csv.field_size_limit() + 1))]
+        result = imports.import_prices(self.pricelist, lines, partial=True)
+        self.assertEqual((result.created, result.unreadable, [line for line, message in result.errors]), (0, True, [3]))
+        self.assertEqual(prices.price_as_of(photo), Decimal('1.80'))
+
+        """The command reads a file and fails on errors"""
+        path = os.path.join(tempfile.mkdtemp(), 'prices.csv')
+        with open(path, 'w') as f:
+            f.write('title,price,effective\nMug,6.00,2099-01-01 00:00\n')
+        out = io.StringIO()
+        call_command('importprices', self.pricelist.pk, path, stdout=out)
+        self.assertIn('1 prices created', out.getvalue())
+        self.assertEqual(timezone.localtime(prices.next_change(self.pricelist)).year, 2099)
+        with open(path, 'w') as f:
+            f.write('title,price\nMug,abc\n')
+        with self.assertRaises(CommandError):
+            call_command('importprices', self.pricelist.pk, path, stdout=io.StringIO(), stderr=io.StringIO())
+        with open(path, 'wb') as f:
+            f.write(b'title,price\nMug,6.00\nMu\xe9,6.50\n')
+        err = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('importprices', self.pricelist.pk, path, '--partial', stdout=io.StringIO(), stderr=err)
+        self.assertIn('UTF-8', err.getvalue())
+
+        """The upload view reports the rows with errors"""
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        upload = SimpleUploadedFile('prices.csv', b'title,price\nPhoto,1.95\nNope,2\n', content_type='text/csv')
+        response = self.client.post(reverse('import_prices', args=[self.pricelist.pk]),
+                                    {'file': upload, 'partial': 'on'})
+        self.assertContains(response, 'Line 3')
+        self.assertEqual(prices.price_as_of(photo), Decimal('1.95'))
+
+    def testLoadRates(self):
+        """Feed rates are converted through each pricelist's base currency"""
+        zar = PriceListCurrency.objects.create(pricelist=self.pricelist, title='Rand', code='ZAR', symbol='R')
+        eur = PriceListCurrency.objects.create(pricelist=self.pricelist, title='Euro', code='EUR', symbol='E')
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('14.5'))
+        PriceListCurrencyRate.objects.create(currency=eur, rate=Decimal('0.9'))
+
+        other = PriceList.objects.create(title='Other', description='Other base', owner=self.user)
+        PriceListCurrency.objects.create(pricelist=other, title='BASE', code='BAS', symbol='$', base=True)
+        PriceListCurrency.objects.create(pricelist=other, title='Rand', code='ZAR', symbol='R')
+
+        feeds = tempfile.mkdtemp()
+        with open(os.path.join(feeds, 'eurofxref-daily.xml'), 'w') as f:
+            f.write('<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" '
+                    'xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref"><Cube><Cube time="2019-05-10">'
+                    '<Cube currency="USD" rate="1.1"/><Cube currency="ZAR" rate="20"/>'
+                    '</Cube></Cube></gesmes:Envelope>')
+
+        out = io.StringIO()
+        call_command('loadrates', feeds, stdout=out)
+        self.assertIn('2 currencies updated in 1 pricelists, 0 unchanged, 1 skipped', out.getvalue())
+        self.assertEqual(prices.rate_as_of(zar), Decimal('18.18181818'))
+        self.assertEqual(prices.rate_as_of(eur), Decimal('0.90909091'))
+        self.assertEqual(PriceListCurrency.objects.get(pk=zar.pk).current_rate(), Decimal('18.18181818'))
+
+        """Unchanged rates are not written again"""
+        count = PriceListCurrencyRate.objects.count()
+        result = rates.apply_rates(rates.read_feed(rates.feed_file(feeds)))
+        self.assertEqual((result['updated'], result['unchanged']), (0, 2))
+        self.assertEqual(PriceListCurrencyRate.objects.count(), count)
+
+        """CSV feeds are read the same way"""
+        path = os.path.join(feeds, 'rates.csv')
+        with open(path, 'w') as f:
+            f.write('code,rate\nUSD,1\nZAR,15\n')
+        result = rates.apply_rates(rates.read_feed(path, 'USD'), currencies=PriceListCurrency.objects.filter(pk=zar.pk))
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual(prices.rate_as_of(zar), Decimal('15.00000000'))
+
+    def testCurrentPriceTable(self):
+        """New prices and rates update the projection in the same transaction"""
+        zar = PriceListCurrency.objects.create(pricelist=self.pricelist, title='Rand', code='ZAR', symbol='R')
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('14.333'))
+        photo = self.addProduct('Photo', (1, '1.25'))
+        row = projection.current_price(self.pricelist.pk, photo.product_id, 'zar')
+        self.assertEqual((row.price, row.version), (Decimal('17.92'), 1))
+        self.assertEqual(projection.current_price(self.pricelist.pk, photo.product_id, 'USD').price, Decimal('1.25'))
+
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('15'))
+        row = projection.current_price(self.pricelist.pk, photo.product_id, 'ZAR')
+        self.assertEqual((row.price, row.version), (Decimal('18.75'), 2))
+
+        """Scheduled prices take over once in effect"""
+        later = timezone.now() + timedelta(hours=1)
+        PriceListProductPrice.objects.create(listproduct=photo, price=Decimal('2.00'), date_effective=later)
+        self.assertEqual(projection.current_price(self.pricelist.pk, photo.product_id, 'ZAR').price, Decimal('18.75'))
+        with mock.patch('django.utils.timezone.now', return_value=later + timedelta(seconds=1)):
+            self.assertEqual(projection.current_price(self.pricelist.pk, photo.product_id, 'ZAR').price, Decimal('30.00'))
+
+        """A price whose projection can't be refreshed is not saved"""
+        with mock.patch.object(signals, 'refresh', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                PriceListProductPrice.objects.create(listproduct=photo, price=Decimal('9.00'))
+            with self.assertRaises(RuntimeError):
+                PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('99'))
+        self.assertFalse(PriceListProductPrice.objects.filter(price=Decimal('9.00')).exists())
+        self.assertFalse(PriceListCurrencyRate.objects.filter(rate=Decimal('99')).exists())
+
+        """The rebuild command repairs drift"""
+        CurrentPrice.objects.filter(currency=zar).update(price=Decimal('1.00'))
+        CurrentPrice.objects.filter(currency=self.base).delete()
+        out = io.StringIO()
+        call_command('rebuildcurrentprices', stdout=out)
+        self.assertIn('1 created, 1 updated, 0 deleted', out.getvalue())
+
+        """Products taken off the pricelist lose their rows"""
+        photo.delete()
+        self.assertFalse(CurrentPrice.objects.filter(pricelist=self.pricelist).exists())
+
+    def testExport(self):
+        """Exports are rendered once per version and revalidated with the ETag"""
+        zar = PriceListCurrency.objects.create(pricelist=self.pricelist, title='Rand', code='ZAR', symbol='R')
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('14.5'))
+        photo = self.addProduct('Photo', (1, '1.50'))
+        url = reverse('export_pricelist', kwargs={'pk': self.pricelist.pk, 'format': 'json'})
+
+        with mock.patch.object(exports, 'PRICELIST_EXPORT_ROOT', tempfile.mkdtemp()):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+            data = json.loads(b''.join(response.streaming_content))
+            self.assertEqual(data['products'], [{'product': photo.product_id, 'title': 'Photo',
+                                                 'prices': {'USD': '1.50', 'ZAR': '21.75'}}])
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            """A new price changes the version"""
+            PriceListProductPrice.objects.create(listproduct=photo, price=Decimal('2.00'))
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            response.close()
+
+            """Other versions are kept until they are old, then removed when a new one is written"""
+            directory = os.path.join(exports.PRICELIST_EXPORT_ROOT, str(self.pricelist.pk))
+            self.assertEqual(len(os.listdir(directory)), 2)
+            response = self.client.get(url)
+            for name in os.listdir(directory):
+                os.utime(os.path.join(directory, name), (0, 0))
+            PriceListProductPrice.objects.create(listproduct=photo, price=Decimal('2.50'))
+            self.client.get(url).close()
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(json.loads(b''.join(response.streaming_content))['products'][0]['prices']['USD'], '2.00')
+
+            """A removed export is written again"""
+            os.remove(os.path.join(directory, os.listdir(directory)[0]))
+            response = self.client.get(url)
+            self.assertEqual(json.loads(b''.join(response.streaming_content))['products'][0]['prices']['USD'], '2.50')
+
+            response = self.client.get(reverse('export_pricelist', kwargs={'pk': self.pricelist.pk, 'format': 'csv'}))
+            self.assertEqual(b''.join(response.streaming_content).decode().splitlines()[1],
+                             '{},Photo,2.50,36.25'.format(photo.product_id))
+
+            """Inactive pricelists are private"""
+            self.pricelist.active = False
+            self.pricelist.save()
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def testCompactHistory(self):
+        """Only the last row before the cutoff is kept, later history is left as is"""
+        photo = self.addProduct('Photo', (500, '1.00'), (450, '1.00'), (400, '1.20'), (380, '1.30'),
+                                (100, '1.30'), (50, '1.40'), (10, '1.40'))
+        rate = PriceListCurrencyRate.objects.create(currency=self.base, rate=Decimal('1.00'))
+        PriceListCurrencyRate.objects.filter(pk=rate.pk).update(date_effective=timezone.now() - timedelta(days=30))
+        moments = [timezone.now() - timedelta(days=days) for days in (364, 200, 100, 50, 10, 0)]
+        before = [prices.price_as_of(photo, at) for at in moments]
+
+        out = io.StringIO()
+        call_command('compactpricehistory', '--dry-run', stdout=out)
+        self.assertIn('pricelists.PriceListProductPrice: 3 rows to remove', out.getvalue())
+        self.assertIn('pricelists.PriceListCurrencyRate: 0 rows to remove', out.getvalue())
+        self.assertEqual(PriceListProductPrice.objects.filter(listproduct=photo).count(), 7)
+
+        archive = tempfile.mkdtemp()
+        with mock.patch.object(history, 'DELETE_BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            call_command('compactpricehistory', '--archive', archive, stdout=io.StringIO())
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(list(PriceListProductPrice.objects.filter(listproduct=photo)
+                              .order_by('date_effective').values_list('price', flat=True)),
+                         [Decimal('1.30'), Decimal('1.30'), Decimal('1.40'), Decimal('1.40')])
+        self.assertEqual(PriceListCurrencyRate.objects.filter(currency=self.base).count(), 2)
+        self.assertEqual([prices.price_as_of(photo, at) for at in moments], before)
+
+        """The removed rows are archived"""
+        with gzip.open(os.path.join(archive, os.listdir(archive)[0]), 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row['value'] for row in rows), ['1.00', '1.00', '1.20'])
+
+        """Lookups before the cutoff are refused rather than answered wrongly"""
+        before_cutoff = timezone.now() - timedelta(days=420)
+        with self.assertRaises(prices.HistoryCompacted):
+            prices.price_as_of(photo, before_cutoff)
+        with self.assertRaises(prices.HistoryCompacted):
+            prices.rate_as_of(self.base, before_cutoff)
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        url = reverse('detailed_pricelist', args=[self.pricelist.pk])
+        response = self.client.get(url, {'at': before_cutoff.date().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'at': moments[0].date().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        """Compacting again finds nothing"""
+        self.assertEqual(history.compact(timezone.now() - timedelta(days=365), dry_run=True),
+                         {'pricelists.PriceListProductPrice': 0, 'pricelists.PriceListCurrencyRate': 0})
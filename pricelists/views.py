@@ -2,20 +2,29 @@ from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, get_user_model
 from django.contrib.auth.decorators import login_required
-from django.http import Http404
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_list_or_404, get_object_or_404, render, redirect
 from django.views.generic import CreateView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, FormView, UpdateView
 from django.views.generic.list import ListView
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
 from django.utils.decorators import method_decorator
 from django.views import View
 
 from decimal import Decimal
+import io
 
-from .forms import PriceListForm, PriceListCurrencyForm, PriceListProductForm, PriceListProductEditForm
+from .exports import CONTENT_TYPES, get_export
+from .forms import ImportPricesForm, PriceListForm, PriceListCurrencyForm, PriceListProductForm, PriceListProductEditForm
+from .imports import import_prices
 from .models import PriceList, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
+from .matrix import price_matrix
+from .pricecache import price_cache
+from .prices import HistoryCompacted, check_history, price_as_of, rate_as_of, with_current_price, with_current_rate
 
 User = get_user_model()
 
@@ -56,6 +65,7 @@ class CreateCurrencyView(CreateView):
     def get_context_data(self, *args, **kwargs):
         context = super(CreateCurrencyView, self).get_context_data(*args, **kwargs)
         context['pricelist'] = self.pricelist
+        context['currencies'] = with_current_rate(self.pricelist.pricelistcurrency_set.all())
         return context
 
     # on save, inital rate
@@ -72,12 +82,10 @@ class EditCurrencyView(UpdateView):
     model = PriceListCurrency
     form_class = PriceListCurrencyForm
     success_url = reverse_lazy('create_currency')
-    currencyrate = None
 
-    # Set the base price to the last
+    # Set the base rate to the one in effect
     def get_initial(self):
-        self.currencyrate = PriceListCurrencyRate.objects.order_by('date_effective').filter(currency=self.get_object()).last()
-        return { 'baserate':self.currencyrate.rate, }
+        return { 'baserate':rate_as_of(self.get_object()), }
 
     def form_valid(self, form):
         # Save the main form
@@ -87,10 +95,11 @@ class EditCurrencyView(UpdateView):
         print(currency)
         self.success_url = reverse_lazy('create_currency', kwargs={'pk': currency.pricelist.pk})
 
-        # Create a new price if it has changed and not a base currency
-        if self.currencyrate.rate != form.cleaned_data['baserate'] and not currency.base:
+        # Create a new rate, now or scheduled, if it has changed and not a base currency
+        if form.initial['baserate'] != form.cleaned_data['baserate'] and not currency.base:
             PriceListCurrencyRate.objects.create(currency=currency,
-                            rate=form.cleaned_data['baserate'])
+                            rate=form.cleaned_data['baserate'],
+                            date_effective=form.cleaned_data.get('effective') or timezone.now())
 
         return super(EditCurrencyView, self).form_valid(form)
 
@@ -127,7 +136,7 @@ class ListPriceListView(ListView):
     def get_queryset(self):
         queryset = super(ListPriceListView, self).get_queryset()
         if not self.request.user.is_staff:
-            queryset = queryset.filter(creator=self.request.user)
+            queryset = queryset.filter(owner=self.request.user)
         return queryset
 
 
@@ -155,6 +164,34 @@ class DetailedPriceListView(DetailView):
     template_name = 'pricelist/detail.html'
     model = PriceList
 
+    # Prices at a time whose history was compacted can't be shown
+    def get(self, request, *args, **kwargs):
+        try:
+            return super(DetailedPriceListView, self).get(request, *args, **kwargs)
+        except HistoryCompacted as error:
+            return HttpResponseBadRequest(str(error))
+
+    #Add the products with their prices now, or at the ?at= date or time
+    def get_context_data(self, *args, **kwargs):
+        context = super(DetailedPriceListView, self).get_context_data(*args, **kwargs)
+        at = self.get_at()
+        context['at'] = at
+        context['products'] = with_current_price(self.object.pricelistproduct_set.select_related('product'), at)
+        return context
+
+    def get_at(self):
+        value = self.request.GET.get('at', '')
+        try:
+            at = parse_datetime(value)
+            if at is None and parse_date(value):
+                at = parse_datetime('{}T23:59:59'.format(value))
+        except ValueError:
+            raise Http404
+        if at is not None and timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        check_history(at)
+        return at
+
 
 @method_decorator(login_required, name='dispatch')
 class EditPriceListView(UpdateView):
@@ -212,6 +249,7 @@ class CreatePriceListProductView(CreateView):
     def get_context_data(self, *args, **kwargs):
         context = super(CreatePriceListProductView, self).get_context_data(*args, **kwargs)
         context['pricelist'] = self.pricelist
+        context['products'] = with_current_price(self.pricelist.pricelistproduct_set.select_related('product'))
         return context
 
     # on save, inital base price
@@ -228,20 +266,18 @@ class EditPriceListProductView(UpdateView):
     model = PriceListProduct
     form_class = PriceListProductEditForm
     success_url = reverse_lazy('create_pricelistproduct')
-    productprice = None
 
     # Make sure the pricelist belongs to the user
     def get_queryset(self):
         queryset = super(EditPriceListProductView, self).get_queryset()
         if not self.request.user.is_staff:
-            queryset = queryset.filter(pricelist__creator=self.request.user)
+            queryset = queryset.filter(pricelist__owner=self.request.user)
         return queryset
 
-    # Set the base price to the last
+    # Set the base price to the one in effect
     def get_initial(self):
-        self.productprice = PriceListProductPrice.objects.order_by('date_effective').filter(listproduct=self.get_object()).last()
         return {
-            'baseprice':self.productprice.price,
+            'baseprice':price_as_of(self.get_object()),
         }
 
     def form_valid(self, form):
@@ -249,15 +285,47 @@ class EditPriceListProductView(UpdateView):
 
         self.success_url = reverse_lazy('create_pricelistproduct', kwargs={'pk': product.pricelist.pk})
 
-        # Create a new price if it has changed
-        if self.productprice.price != form.cleaned_data['baseprice']:
+        # Create a new price, now or scheduled, if it has changed
+        if form.initial['baseprice'] != form.cleaned_data['baseprice']:
             productprice = PriceListProductPrice.objects.create(
                             listproduct=product,
-                            price=form.cleaned_data['baseprice'])
+                            price=form.cleaned_data['baseprice'],
+                            date_effective=form.cleaned_data.get('effective') or timezone.now())
 
         return super(EditPriceListProductView, self).form_valid(form)
 
 
+"""Import the base prices of many pricelist products from a CSV upload"""
+@method_decorator(login_required, name='dispatch')
+class ImportPricesView(FormView):
+    template_name = 'pricelistproduct/import.html'
+    form_class = ImportPricesForm
+    pricelist = None
+
+    # Only the owner or staff can import
+    def dispatch(self, request, *args, **kwargs):
+        self.pricelist = get_object_or_404(PriceList, pk=self.kwargs.get('pk'))
+        if not self.pricelist.is_owner(self.request.user) and not self.request.user.is_staff:
+            raise Http404
+        return super(ImportPricesView, self).dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, *args, **kwargs):
+        context = super(ImportPricesView, self).get_context_data(*args, **kwargs)
+        context['pricelist'] = self.pricelist
+        return context
+
+    def form_valid(self, form):
+        lines = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+        result = import_prices(self.pricelist, lines, form.cleaned_data['effective'], form.cleaned_data['partial'])
+
+        if result.unreadable or (result.errors and not form.cleaned_data['partial']):
+            messages.error(self.request, 'Nothing was imported, {} rows have errors.'.format(len(result.errors)))
+        else:
+            messages.success(self.request, '{} prices imported, {} unchanged, {} rows with errors.'.format(
+                             result.created, result.unchanged, len(result.errors)))
+        return self.render_to_response(self.get_context_data(form=form, result=result))
+
+
 @method_decorator(login_required, name='dispatch')
 class DeletePriceListProductView(View):
     success_url = reverse_lazy('create_pricelistproduct')
@@ -277,6 +345,51 @@ class DeletePriceListProductView(View):
         return redirect(self.success_url)
 
 
+"""Export a whole pricelist as JSON or CSV.
+
+Active pricelists are public so point of sale systems can poll them, others
+are only exported to their owner and staff. The ETag is the pricelist
+version, so polls of an unchanged pricelist are answered with a 304.
+"""
+class ExportPriceListView(View):
+    def get(self, request, pk, format):
+        pricelist = get_object_or_404(PriceList, pk=pk)
+        if format not in CONTENT_TYPES:
+            raise Http404
+        if not pricelist.active and not (pricelist.is_owner(request.user) or request.user.is_staff):
+            raise Http404
+
+        export, version = get_export(pricelist, format)
+        etag = quote_etag('{}-{}'.format(version, format))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(export, content_type=CONTENT_TYPES[format])
+            if format == 'csv':
+                response['Content-Disposition'] = 'attachment; filename="pricelist-{}.csv"'.format(pricelist.pk)
+        else:
+            export.close()
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+"""Every product's price in every currency of the pricelist, in minor units, for its owner and staff"""
+@method_decorator(login_required, name='dispatch')
+class PriceMatrixView(View):
+    def get(self, request, **kwargs):
+        pricelist = get_object_or_404(PriceList, pk=self.kwargs['pk'])
+        if not (pricelist.is_owner(request.user) or request.user.is_staff):
+            raise Http404
+        return JsonResponse(price_matrix.payload(pricelist.pk), json_dumps_params={'separators': (',', ':')})
+
+
+"""Hit and miss counters of this process's price cache"""
+@method_decorator(staff_member_required, name='dispatch')
+class PriceCacheStatsView(View):
+    def get(self, request, **kwargs):
+        return JsonResponse(dict(price_cache.stats(), matrix=price_matrix.stats()))
+
+
 @method_decorator(login_required, name='dispatch')
 class ListRateView(ListView):
     pass
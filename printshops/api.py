@@ -0,0 +1,117 @@
+from django.conf import settings
+
+from rest_framework import serializers, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from pricelists.matrix import money, to_minor
+from pricelists.projection import current_prices
+
+from .geo import NEARBY_SHOP_LIMIT, NEARBY_SHOP_MAX_LIMIT, NEARBY_SHOP_MAX_RADIUS, NEARBY_SHOP_RADIUS
+from .models import PrintShop, PrintShopPriceList
+
+# Largest number of lines quoted in one request
+MAX_QUOTE_LINES = getattr(settings, 'MAX_QUOTE_LINES', 500)
+
+
+class QuoteLineSerializer(serializers.Serializer):
+    printshop = serializers.SlugField(max_length=128)
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=100000)
+    currency = serializers.CharField(min_length=3, max_length=3)
+
+    def validate_currency(self, value):
+        return value.upper()
+
+
+class QuoteSerializer(serializers.Serializer):
+    lines = QuoteLineSerializer(many=True, allow_empty=False)
+
+    def validate_lines(self, value):
+        if len(value) > MAX_QUOTE_LINES:
+            raise serializers.ValidationError('At most {} lines can be quoted at once.'.format(MAX_QUOTE_LINES))
+        return value
+
+
+class NearbySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=0, max_value=NEARBY_SHOP_MAX_RADIUS, default=NEARBY_SHOP_RADIUS)
+    limit = serializers.IntegerField(min_value=1, max_value=NEARBY_SHOP_MAX_LIMIT, default=NEARBY_SHOP_LIMIT)
+
+
+"""Quote many (printshop, product, quantity, currency) lines in one request.
+
+The active pricelists of every shop in the request are found with one query
+and the converted prices are read from the CurrentPrice projection with
+another, so the cost does not grow with the number of lines. A product on
+several pricelists of a shop is quoted from the pricelist with the lowest pk.
+Unit prices are multiplied by the quantity. The response holds each line's
+unit and line price, totals per currency and the version of every pricelist
+used, or the errors of the lines that cannot be quoted.
+"""
+class QuoteView(APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = QuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data['lines']
+
+        pricelists = {}
+        versions = {}
+        for slug, pricelist, version in (PrintShopPriceList.objects
+                                         .filter(printshop__slug__in={line['printshop'] for line in lines},
+                                                 printshop__active=True, pricelist__active=True)
+                                         .order_by('pricelist')
+                                         .values_list('printshop__slug', 'pricelist', 'pricelist__cache_version')):
+            pricelists.setdefault(slug, []).append(pricelist)
+            versions[pricelist] = version
+        prices = current_prices(versions, {line['product'] for line in lines}) if versions else {}
+
+        quoted = []
+        errors = []
+        totals = {}
+        for index, line in enumerate(lines):
+            if line['printshop'] not in pricelists:
+                errors.append({'line': index, 'detail': 'Print shop "{}" does not quote.'.format(line['printshop'])})
+                continue
+            pricelist = next((pricelist for pricelist in pricelists[line['printshop']]
+                              if (pricelist, line['product']) in prices), None)
+            if pricelist is None:
+                errors.append({'line': index, 'detail': 'Product {} has no price at this print shop.'.format(line['product'])})
+                continue
+            price = prices[pricelist, line['product']].get(line['currency'])
+            if price is None:
+                errors.append({'line': index, 'detail': 'Currency {} is not offered for this product.'.format(line['currency'])})
+                continue
+
+            unit = to_minor(price)
+            total = unit * line['quantity']
+            totals[line['currency']] = totals.get(line['currency'], 0) + total
+            quoted.append(dict(line, pricelist=pricelist, unit_price=money(unit), line_price=money(total)))
+
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'lines': quoted,
+            'totals': {currency: money(total) for currency, total in sorted(totals.items())},
+            'versions': {str(pricelist): versions[pricelist] for pricelist in sorted(versions)},
+        })
+
+
+"""The nearest active print shops to ?lat=&lon=, within ?radius= km, at most ?limit="""
+class NearbyShopsView(APIView):
+    def get(self, request, *args, **kwargs):
+        serializer = NearbySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+
+        shops = PrintShop.nearby(query['lat'], query['lon'], query['radius'], query['limit'])
+        return Response({'shops': [{
+            'slug': shop.slug,
+            'name': shop.name,
+            'city': shop.city,
+            'country': shop.country,
+            'url': shop.get_absolute_url(),
+            'distance': round(distance, 3),
+        } for shop, distance in shops]})
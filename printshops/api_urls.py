@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path('quote/', api.QuoteView.as_view(), name='api_quote'),
+    path('shops/nearby/', api.NearbyShopsView.as_view(), name='api_nearby_shops'),
+]
@@ -0,0 +1,14 @@
+import django_filters
+
+from .models import PrintShop
+
+
+"""Print shop directory filters, exact matches so the (field, name, id) indexes serve them"""
+class PrintShopFilter(django_filters.FilterSet):
+    city = django_filters.CharFilter()
+    country = django_filters.CharFilter()
+    active = django_filters.BooleanFilter()
+
+    class Meta:
+        model = PrintShop
+        fields = ('city', 'country', 'active')
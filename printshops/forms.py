@@ -17,6 +17,10 @@ class PrintShopUserForm(forms.ModelForm):
     class Meta:
         model = PrintShopUser
         exclude = ('creator', )
+        # Users are picked with the user search, not from a list of every user
+        widgets = {
+            'user': forms.HiddenInput,
+        }
 
 
 """Printshop Pricelists"""
@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.db.models import Q
+
+import numpy as np
+import math
+
+# Radius searched when none is given, and the largest one allowed, in kilometres
+NEARBY_SHOP_RADIUS = getattr(settings, 'NEARBY_SHOP_RADIUS', 25)
+NEARBY_SHOP_MAX_RADIUS = getattr(settings, 'NEARBY_SHOP_MAX_RADIUS', 500)
+
+# Shops returned when no limit is given, and the most that can be asked for
+NEARBY_SHOP_LIMIT = getattr(settings, 'NEARBY_SHOP_LIMIT', 10)
+NEARBY_SHOP_MAX_LIMIT = getattr(settings, 'NEARBY_SHOP_MAX_LIMIT', 100)
+
+EARTH_RADIUS = 6371.0088
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Stored geohashes are about a metre across, searches use coarser prefixes of them
+GEOHASH_PRECISION = 9
+
+# Most geohash cells a search covers, the finest precision within it is used
+MAX_CELLS = 32
+
+
+def cell_bits(precision):
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def cell_index(lat, lon, precision):
+    lon_bits, lat_bits = cell_bits(precision)
+    x = int((lon + 180) / 360 * (1 << lon_bits))
+    y = int((lat + 90) / 180 * (1 << lat_bits))
+    return min(max(x, 0), (1 << lon_bits) - 1), min(max(y, 0), (1 << lat_bits) - 1)
+
+
+"""Geohash of the cell at longitude index x and latitude index y"""
+def cell_hash(x, y, precision):
+    lon_bits, lat_bits = cell_bits(precision)
+    value = 0
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            value = value << 1 | (x >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            value = value << 1 | (y >> lat_bits) & 1
+    return ''.join(BASE32[value >> shift & 31] for shift in range(5 * (precision - 1), -1, -5))
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    return cell_hash(*cell_index(float(lat), float(lon), precision), precision)
+
+
+"""Geohash prefixes covering every point within radius km of lat, lon.
+
+The bounding box of the circle is covered with cells of the finest precision
+that needs at most MAX_CELLS of them, wrapping around the antimeridian and
+taking every longitude near the poles.
+"""
+def covering_cells(lat, lon, radius):
+    lat_span = math.degrees(radius / EARTH_RADIUS)
+    south, north = max(lat - lat_span, -90), min(lat + lat_span, 90)
+    if north >= 90 or south <= -90:
+        lon_span = 180
+    else:
+        lon_span = min(math.degrees(radius / (EARTH_RADIUS * math.cos(math.radians(max(abs(south), abs(north)))))), 180)
+    lon = float(lon)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lon_bits, lat_bits = cell_bits(precision)
+        bottom, top = cell_index(south, 0, precision)[1], cell_index(north, 0, precision)[1]
+        west = math.floor((lon - lon_span + 180) / 360 * (1 << lon_bits))
+        east = math.floor((lon + lon_span + 180) / 360 * (1 << lon_bits))
+        columns = range(1 << lon_bits) if east - west + 1 >= 1 << lon_bits else \
+                  [column % (1 << lon_bits) for column in range(west, east + 1)]
+        if len(columns) * (top - bottom + 1) <= MAX_CELLS or precision == 1:
+            return [cell_hash(x, y, precision) for x in columns for y in range(bottom, top + 1)]
+
+
+"""Filter matching geohash fields that start with any of the prefixes, as index range scans"""
+def prefix_filter(prefixes, field='geohash'):
+    query = Q()
+    for prefix in prefixes:
+        query |= Q(**{field + '__gte': prefix, field + '__lt': prefix + '~'})
+    return query
+
+
+"""Great circle distance in km from lat, lon to arrays of latitudes and longitudes"""
+def haversine(lat, lon, lats, lons):
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+"""The limit nearest of the candidates within radius km of lat, lon.
+
+candidates are (pk, latitude, longitude) rows, as returned by values_list(),
+and are ranked by exact distance in one NumPy pass. Returns (pk, distance)
+pairs, nearest first.
+"""
+def nearest(lat, lon, candidates, radius, limit):
+    rows = np.asarray(list(candidates), dtype=float).reshape(-1, 3)
+    if not len(rows):
+        return []
+    distance = haversine(lat, lon, rows[:, 1], rows[:, 2])
+    within = np.flatnonzero(distance <= radius)
+    if len(within) > limit:
+        within = within[np.argpartition(distance[within], limit - 1)[:limit]]
+    within = within[np.lexsort((rows[within, 0], distance[within]))]
+    return [(int(rows[index, 0]), float(distance[index])) for index in within]
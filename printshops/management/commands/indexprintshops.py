@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from printshops.geo import encode
+from printshops.models import PrintShop
+
+
+class Command(BaseCommand):
+    help = 'Recompute the geohash every print shop is found by in nearby searches'
+
+    def handle(self, *args, **options):
+        changed = []
+        for shop in PrintShop.objects.only('latitude', 'longitude', 'geohash').iterator():
+            geohash = encode(shop.latitude, shop.longitude)
+            if shop.geohash != geohash:
+                shop.geohash = geohash
+                changed.append(shop)
+
+        # bulk_update leaves date_updated and the save signals alone
+        PrintShop.objects.bulk_update(changed, ['geohash'], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS('{} print shops reindexed'.format(len(changed))))
@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
 from django.db import models
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import ugettext_lazy as _
 
@@ -11,8 +12,12 @@ from phonenumber_field.modelfields import PhoneNumberField
 User = get_user_model()
 
 from pricelists.models import PriceList
+from products.models import ProductImage
+from products.storage import blob_storage
 from user.models import Group, GroupUser
 
+from .geo import covering_cells, encode, nearest, prefix_filter
+
 class PrintShop(models.Model):
     name = models.CharField(_('Shop Name'), max_length=128, unique=True)
     slug = models.CharField(unique=True, max_length=128, blank=True, null=True)
@@ -28,7 +33,8 @@ class PrintShop(models.Model):
     country = models.CharField(_("Country"), max_length = 40, blank = True)
     latitude = models.DecimalField(_("Latitude"), max_digits=10, decimal_places=7, default=0)
     longitude = models.DecimalField(_("Longitude"), max_digits=10, decimal_places=7, default=0)
-    logo = models.ImageField(_('Shop Logo'), upload_to='logos/%Y/%m/%d/')
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    logo = models.ImageField(_('Shop Logo'), upload_to='logos/%Y/%m/%d/', storage=blob_storage)
     active = models.BooleanField(default=False)
     date_added = models.DateTimeField(_('Created'), auto_now_add=True)
     date_updated = models.DateTimeField(_('Last Updated'), auto_now=True)
@@ -36,6 +42,7 @@ class PrintShop(models.Model):
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
+        self.geohash = encode(self.latitude, self.longitude)
         super(PrintShop, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -48,28 +55,48 @@ class PrintShop(models.Model):
         """ Sends an email to the shop email address. """
         res = send_mail(subject, message, from_email, [self.email], **kwargs)
 
+    """The shop's staff group, read once per shop object"""
+    @cached_property
+    def staff_group(self):
+        return PrintShopGroup.objects.get(printshop=self)
+
     """Check if user is staff for the shop"""
     def is_shop_staff(self, user):
-        if PrintShopUser.objects.filter(
-                        group=PrintShopGroup.objects.get(printshop=self),
-                        user=user, user__is_active=True):
-            return True
-
-        else:
-            return False
+        return self.staff_group.is_member(user)
 
     """Check if user is admin for the shop"""
     def is_shop_admin(self, user):
-        if PrintShopUser.objects.filter(
-                        group=PrintShopGroup.objects.get(printshop=self),
-                        user=user, admin=True, user__is_active=True):
-            return True
-
-        else:
-            return False
+        return self.staff_group.is_admin(user)
+
+    """Image slots of every product on the shop's active pricelists, as matcher rows"""
+    def image_slots(self):
+        return ProductImage.objects.filter(
+                        product__pricelistproduct__pricelist__printshoppricelist__printshop=self,
+                        product__pricelistproduct__pricelist__active=True).distinct().values_list(
+                        'pk', 'product', 'ratio', 'rotatable', 'min_megapixels', 'warn_megapixels')
+
+    """The limit nearest active shops within radius km of lat, lon, as (shop, km) pairs.
+
+    Candidates come from the geohash cells covering the circle, through the
+    (active, geohash) index, and are ranked by exact haversine distance.
+    """
+    @classmethod
+    def nearby(cls, lat, lon, radius, limit):
+        candidates = cls.objects.filter(prefix_filter(covering_cells(lat, lon, radius)), active=True) \
+                                .values_list('pk', 'latitude', 'longitude')
+        ranked = nearest(lat, lon, candidates, radius, limit)
+        shops = cls.objects.in_bulk([pk for pk, distance in ranked])
+        return [(shops[pk], distance) for pk, distance in ranked if pk in shops]
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=['active', 'geohash']),
+            # Filtered directory pages are read in (name, id) order, the unique name index serves the rest
+            models.Index(fields=['city', 'name', 'id']),
+            models.Index(fields=['country', 'name', 'id']),
+            models.Index(fields=['active', 'name', 'id']),
+        ]
         verbose_name = "Print Shop"
         verbose_name_plural = "Print Shops"
 
@@ -0,0 +1,67 @@
+from django.db.models import Q
+
+import base64, json
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode()
+
+
+# Cursor values are the JSON of the field values, whole numbers or strings
+def cursor_types(model, fields):
+    return [int if model._meta.get_field(field).get_internal_type().endswith(('AutoField', 'IntegerField')) else str
+            for field in fields]
+
+
+"""Values of a cursor, one of each of types. Raises ValueError for anything else."""
+def decode_cursor(cursor, types):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if (not isinstance(values, list) or len(values) != len(types)
+            or any(type(value) is not kind for value, kind in zip(values, types))):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+"""Rows ordered after (or before, when reverse) values on fields, in lexicographic order"""
+def after_filter(fields, values, reverse=False):
+    lookup = '__lt' if reverse else '__gt'
+    query = Q()
+    for index, field in enumerate(fields):
+        query |= Q(**dict(zip(fields[:index], values[:index])), **{field + lookup: values[index]})
+    return query
+
+
+class KeysetPage:
+    def __init__(self, object_list, fields, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next and bool(object_list)
+        self.has_previous = has_previous and bool(object_list)
+        self.next_cursor = self.cursor(object_list[-1], fields) if self.has_next else None
+        self.previous_cursor = self.cursor(object_list[0], fields) if self.has_previous else None
+
+    @staticmethod
+    def cursor(obj, fields):
+        return encode_cursor([getattr(obj, field) for field in fields])
+
+
+"""A page of queryset ordered by fields, which must end in a unique field.
+
+Pages start after the after cursor, or end before the before cursor, so the
+database seeks straight to the page through an index on fields and the last
+page costs the same as the first. Raises ValueError for a bad cursor.
+"""
+def keyset_page(queryset, fields, size, after=None, before=None):
+    types = cursor_types(queryset.model, fields)
+    if before:
+        values = decode_cursor(before, types)
+        rows = list(queryset.filter(after_filter(fields, values, reverse=True))
+                            .order_by(*['-' + field for field in fields])[:size + 1])
+        return KeysetPage(rows[:size][::-1], fields, True, len(rows) > size)
+
+    if after:
+        queryset = queryset.filter(after_filter(fields, decode_cursor(after, types)))
+    rows = list(queryset.order_by(*fields)[:size + 1])
+    return KeysetPage(rows[:size], fields, len(rows) > size, bool(after))
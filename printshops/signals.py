@@ -1,11 +1,13 @@
 from django.contrib.sites.models import Site
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 
-from .models import PrintShop
+from user.signals import touch_group
+
+from .models import PrintShop, PrintShopUser
 from .token import confirmation_token
 
 current_site = Site.objects.get_current()
@@ -15,9 +17,26 @@ current_site = Site.objects.get_current()
 @receiver(pre_save,sender=PrintShop)
 def pre_check_email(sender, instance, **kwargs):
     if instance.id:
-        _old_email = instance._old_email = sender.objects.get(id=instance.id).email
+        old = sender.objects.get(id=instance.id)
+        _old_email = instance._old_email = old.email
         if _old_email != instance.email:
             instance.email_confirmed = False
+        instance._old_logo = old.logo.name
+    # An upload takes a new reference even when its content is already stored
+    instance._logo_uploaded = bool(instance.logo) and not instance.logo._committed
+
+# Release a replaced logo, it is only removed once no longer shared
+@receiver(post_save,sender=PrintShop)
+def post_release_logo(sender, instance, **kwargs):
+    _old_logo = getattr(instance, '_old_logo', None)
+    if _old_logo and (_old_logo != instance.logo.name or instance._logo_uploaded):
+        instance.logo.storage.delete(_old_logo)
+    instance._old_logo = instance.logo.name
+
+# Release the logo of a deleted print shop
+@receiver(post_delete,sender=PrintShop)
+def delete_logo(sender, instance, **kwargs):
+    instance.logo.delete(False)
 
 # Send an email confirm if email changed
 @receiver(post_save,sender=PrintShop)
@@ -31,3 +50,7 @@ def post_check_email(sender, instance, created, **kwargs):
             'token': confirmation_token(instance.email),
         })
         instance.email_shop(subject, message)
+
+# Print shop staff are group members too
+post_save.connect(touch_group, sender=PrintShopUser)
+post_delete.connect(touch_group, sender=PrintShopUser)
@@ -1,3 +1,304 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from PIL import Image
+
+from rest_framework import status
+
+from pricelists.models import PriceList, PriceListCurrency, PriceListCurrencyRate, PriceListProduct, PriceListProductPrice
+from products.models import Blob, Product
+
+from . import views
+from .pagination import encode_cursor
+from .models import PrintShop, PrintShopGroup, PrintShopUser, PrintShopPriceList
+
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import io, json, os, shutil, tempfile
+
+User = get_user_model()
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def logo_upload(name='logo.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (120, 60), (20, 60, 200)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PrintShopTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = Client()
+        self.loginEmail = 'shop@frog.com'
+        self.loginPassword = 'Shop12345'
+        self.user = User.objects.create_user(email=self.loginEmail, name='Shop User',
+                                             password=self.loginPassword)
+        self.printshop = PrintShop.objects.create(name='Frog Prints', about='Prints',
+                            email='prints@frog.com', phone='+263242123456',
+                            city='Harare', country='Zimbabwe', logo=logo_upload())
+        group = PrintShopGroup.objects.create(printshop=self.printshop, title='Frog Prints - User Group')
+        PrintShopUser.objects.create(group=group, user=self.user, admin=True, creator=True)
+
+        self.pricelist = PriceList.objects.create(title='Retail', description='Retail prices',
+                                                  active=True, owner=self.user)
+        PrintShopPriceList.objects.create(printshop=self.printshop, pricelist=self.pricelist)
+        self.product = Product.objects.create(title='Photo', description='A photo print', owner=self.user)
+        self.listproduct = PriceListProduct.objects.create(pricelist=self.pricelist, product=self.product)
+
+
+    def testLogoReupload(self):
+        """Uploading the same logo again keeps a single reference"""
+        self.printshop.logo = logo_upload('again.png')
+        self.printshop.save()
+        self.assertEqual(Blob.objects.get(name=self.printshop.logo.name).references, 1)
+        path = self.printshop.logo.path
+        self.printshop.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def testMatchPhotos(self):
+        """Suggest the shop's products for a batch of photos"""
+        url = reverse('print_shop_match_photos', kwargs={'slug': self.printshop.slug})
+        data = {'photos': [{'width': 4000, 'height': 3000}, {'width': 300, 'height': 200}]}
+        response = self.client.post(url, json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        fits, small = response.json()['suggestions']
+        self.assertEqual(fits[0]['product'], self.product.pk)
+        self.assertEqual(fits[0]['status'], 'ok')
+        self.assertEqual(small, [])
+
+        """Inactive pricelists are not matched"""
+        self.pricelist.active = False
+        self.pricelist.save()
+        response = self.client.post(url, json.dumps(data), content_type='application/json')
+        self.assertEqual(response.json()['suggestions'], [[], []])
+
+        """Malformed photo lists are refused"""
+        for body in ({'photos': [{}]}, {'photos': [{'width': 'wide', 'height': 200}]},
+                     {'photos': [{'width': -4000, 'height': 3000}]}, dict(data, limit=-1), dict(data, limit=1000)):
+            response = self.client.post(url, json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        """Empty and oversized batches are refused"""
+        with mock.patch.object(views, 'MAX_MATCH_PHOTOS', 2):
+            for photos in ([], data['photos'] * 2):
+                response = self.client.post(url, json.dumps({'photos': photos}), content_type='application/json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.post(url, json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def testQuote(self):
+        """Whole carts are quoted in a fixed number of queries"""
+        self.printshop.active = True
+        self.printshop.save()
+        base = PriceListCurrency.objects.create(pricelist=self.pricelist, title='BASE', code='USD', symbol='$', base=True)
+        PriceListCurrencyRate.objects.create(currency=base, rate=Decimal('1'))
+        zar = PriceListCurrency.objects.create(pricelist=self.pricelist, title='Rand', code='ZAR', symbol='R')
+        PriceListCurrencyRate.objects.create(currency=zar, rate=Decimal('14.333'))
+        PriceListProductPrice.objects.create(listproduct=self.listproduct, price=Decimal('1.25'))
+
+        url = reverse('api_quote')
+        line = {'printshop': self.printshop.slug, 'product': self.product.pk, 'quantity': 3, 'currency': 'zar'}
+        lines = [line, dict(line, currency='USD', quantity=2)]
+        with self.assertNumQueries(2):
+            response = self.client.post(url, json.dumps({'lines': lines * 50}), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        quote = response.json()
+        self.assertEqual(quote['lines'][0]['unit_price'], '17.92')
+        self.assertEqual(quote['lines'][0]['line_price'], '53.76')
+        self.assertEqual(quote['totals'], {'USD': '125.00', 'ZAR': '2688.00'})
+        self.assertEqual(list(quote['versions']), [str(self.pricelist.pk)])
+
+        """Scheduled prices are quoted once in effect"""
+        later = timezone.now() + timedelta(hours=1)
+        PriceListProductPrice.objects.create(listproduct=self.listproduct, price=Decimal('2.00'), date_effective=later)
+        response = self.client.post(url, json.dumps({'lines': [line]}), content_type='application/json')
+        self.assertEqual(response.json()['lines'][0]['unit_price'], '17.92')
+        with mock.patch('django.utils.timezone.now', return_value=later + timedelta(seconds=1)):
+            response = self.client.post(url, json.dumps({'lines': [line]}), content_type='application/json')
+        self.assertEqual(response.json()['lines'][0]['unit_price'], '28.67')
+
+        """Lines that cannot be quoted are reported"""
+        response = self.client.post(url, json.dumps({'lines': [line, dict(line, currency='EUR'), dict(line, printshop='nowhere')]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['line'] for error in response.json()['errors']], [1, 2])
+        response = self.client.post(url, json.dumps({'lines': []}), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def testNearbyShops(self):
+        """The nearest active shops within the radius, nearest first"""
+        self.printshop.latitude, self.printshop.longitude, self.printshop.active = Decimal('-17.8292'), Decimal('31.0522'), True
+        self.printshop.save()
+        for name, latitude, longitude, active in (('Avondale Prints', '-17.8000', '31.0400', True),
+                                                  ('Closed Prints', '-17.8300', '31.0500', False),
+                                                  ('Bulawayo Prints', '-20.1500', '28.5800', True),
+                                                  ('Fiji Prints', '-17.8000', '179.9900', True),
+                                                  ('Suva Prints', '-17.8000', '-179.9900', True)):
+            PrintShop.objects.create(name=name, about=name, email='prints@frog.com', phone='+263242123456',
+                                     city=name, latitude=Decimal(latitude), longitude=Decimal(longitude),
+                                     active=active, logo=logo_upload())
+        self.assertEqual(len(PrintShop.objects.get(name='Avondale Prints').geohash), 9)
+
+        url = reverse('api_nearby_shops')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'lat': '-17.83', 'lon': '31.05'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        shops = response.json()['shops']
+        self.assertEqual([shop['name'] for shop in shops], ['Frog Prints', 'Avondale Prints'])
+        self.assertLess(shops[0]['distance'], 1)
+
+        response = self.client.get(url, {'lat': '-17.83', 'lon': '31.05', 'radius': 500, 'limit': 2})
+        self.assertEqual(len(response.json()['shops']), 2)
+        response = self.client.get(url, {'lat': '-17.83', 'lon': '31.05', 'radius': 500})
+        self.assertEqual(response.json()['shops'][-1]['name'], 'Bulawayo Prints')
+
+        """Searches wrap around the antimeridian"""
+        response = self.client.get(url, {'lat': '-17.8', 'lon': '179.999', 'radius': 5})
+        self.assertEqual([shop['name'] for shop in response.json()['shops']], ['Fiji Prints', 'Suva Prints'])
+
+        response = self.client.get(url, {'lat': '-97', 'lon': '31.05'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('nearby_print_shop'), {'lat': '-17.83', 'lon': '31.05'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([shop.name for shop, distance in response.context['shops']], ['Frog Prints', 'Avondale Prints'])
+
+    def testShopPermissions(self):
+        """Every membership check of a request is answered from one query"""
+        user = User.objects.get(pk=self.user.pk)
+        printshop = PrintShop.objects.get(pk=self.printshop.pk)
+        with self.assertNumQueries(2):
+            self.assertTrue(printshop.is_shop_staff(user))
+            self.assertTrue(printshop.is_shop_admin(user))
+            self.assertTrue(printshop.staff_group.is_member(user))
+            self.assertTrue(printshop.staff_group.is_admin(user))
+
+        other = User.objects.create_user(email='staff@frog.com', name='Staff User', password='Staff12345')
+        self.assertFalse(printshop.is_shop_staff(other))
+        PrintShopUser.objects.create(group=printshop.staff_group, user=other)
+        self.assertTrue(printshop.is_shop_staff(other))
+        self.assertFalse(printshop.is_shop_admin(other))
+
+        """Inactive and anonymous users belong to no shop"""
+        other.is_active = False
+        self.assertFalse(printshop.is_shop_staff(other))
+        self.assertFalse(printshop.is_shop_staff(AnonymousUser()))
+
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        response = self.client.get(reverse('details_print_shop', kwargs={'slug': self.printshop.slug}))
+        self.assertTrue(response.context['admin_user'])
+        self.assertEqual(len(response.context['staff']), 2)
+
+    def testStaffList(self):
+        """Shop admins get the staff as JSON pages, revalidated with the ETag"""
+        url = reverse('print_shop_user_list', kwargs={'slug': self.printshop.slug})
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'page': 1, 'next': None, 'staff': [{
+            'id': PrintShopUser.objects.get(user=self.user).id, 'name': 'Shop User', 'email': self.loginEmail,
+            'admin': True, 'creator': True, 'order_notifications': True, 'customer_notifications': True,
+            'service_notifications': True, 'active': True}]})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        """A new member changes the version"""
+        other = User.objects.create_user(email='staff@frog.com', name='Another Staff', password='Staff12345')
+        PrintShopUser.objects.create(group=self.printshop.staff_group, user=other)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['staff']), 2)
+        etag = response['ETag']
+        other.name = 'Renamed Staff'
+        other.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        with mock.patch.object(views, 'STAFF_PAGE_SIZE', 1):
+            self.assertEqual(self.client.get(url).json()['next'], 2)
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual([staff['name'] for staff in response.json()['staff']], ['Shop User'])
+            self.assertIsNone(response.json()['next'])
+
+        """Only shop admins see the list"""
+        self.client.login(email='staff@frog.com', password='Staff12345')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def testUserSearch(self):
+        """Shop admins search active users who are not yet staff"""
+        for email, name in (('ann@frog.com', 'Ann Frog'), ('andy@frog.com', 'Andy Toad'), ('bob@frog.com', 'Ann Bob')):
+            User.objects.create_user(email=email, name=name, password='Staff12345')
+        PrintShopUser.objects.create(group=self.printshop.staff_group, user=User.objects.get(email='andy@frog.com'))
+
+        url = reverse('print_shop_user_search', kwargs={'slug': self.printshop.slug})
+        self.client.login(email=self.loginEmail, password=self.loginPassword)
+        response = self.client.get(reverse('print_shop_user', kwargs={'slug': self.printshop.slug}))
+        self.assertNotContains(response, 'ann@frog.com')
+        response = self.client.get(url, {'q': 'AN'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['email'] for user in response.json()['users']], ['ann@frog.com', 'bob@frog.com'])
+        self.assertEqual(self.client.get(url).json(), {'users': []})
+
+        with mock.patch.object(views, 'USER_SEARCH_LIMIT', 1):
+            self.assertEqual(len(self.client.get(url, {'q': 'an'}).json()['users']), 1)
+
+        """The user is picked by pk from the search"""
+        response = self.client.post(reverse('print_shop_user', kwargs={'slug': self.printshop.slug}),
+                                    {'action': 'EDIT', 'id': PrintShopUser.objects.get(user=self.user).id})
+        self.assertEqual(response.json()['email'], self.loginEmail)
+        self.assertNotIn('userlist', response.json())
+
+        self.client.login(email='ann@frog.com', password='Staff12345')
+        self.assertEqual(self.client.get(url, {'q': 'an'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def testDirectory(self):
+        """The directory is read a page at a time, every page at the same cost"""
+        for index in range(6):
+            PrintShop.objects.create(name='Shop {}'.format(index), about='Prints', email='prints@frog.com',
+                                     phone='+263242123456', city='Bulawayo' if index % 2 else 'Harare',
+                                     country='Zimbabwe', active=True, logo=logo_upload())
+        url = reverse('list_print_shop')
+        pages = []
+        counts = []
+        with mock.patch.object(views, 'PRINTSHOP_PAGE_SIZE', 3):
+            query = ''
+            while query is not None:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url + '?' + query)
+                counts.append(len(queries))
+                pages.append([shop.name for shop in response.context['object_list']])
+                query = response.context.get('after_query')
+
+            self.assertEqual(pages, [['Frog Prints', 'Shop 0', 'Shop 1'], ['Shop 2', 'Shop 3', 'Shop 4'], ['Shop 5']])
+            self.assertEqual(len(set(counts)), 1)
+
+            """Previous pages seek back from the first row"""
+            response = self.client.get(url + '?' + response.context['before_query'])
+            self.assertEqual([shop.name for shop in response.context['object_list']], ['Shop 2', 'Shop 3', 'Shop 4'])
+
+            """Filters are kept across pages"""
+            response = self.client.get(url, {'city': 'Harare', 'active': 'true'})
+            self.assertEqual([shop.name for shop in response.context['object_list']], ['Shop 0', 'Shop 2', 'Shop 4'])
+            self.assertIsNone(response.context.get('after_query'))
+            response = self.client.get(url, {'city': 'Harare'})
+            self.assertIn('city=Harare', response.context['after_query'])
+
+        self.assertEqual(self.client.get(url, {'after': 'nonsense'}).status_code, status.HTTP_404_NOT_FOUND)
+
+        """Cursors must hold a name and an id"""
+        for values in ([['a'], [1]], ['Shop 1', '1'], ['Shop 1', True], [None, 1]):
+            response = self.client.get(url, {'after': encode_cursor(values)})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,13 +1,14 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.sites.models import Site
-from django.core import serializers
-from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_list_or_404, get_object_or_404, render, redirect
 from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
 from django.utils.decorators import method_decorator
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
@@ -17,10 +18,33 @@ from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, UpdateView
 from django.views.generic.list import ListView
 
+from .api import NearbySerializer
+from .filters import PrintShopFilter
 from .forms import PrintShopForm, PrintShopUserForm, PrintShopPriceListForm
+from .geo import NEARBY_SHOP_MAX_RADIUS, NEARBY_SHOP_RADIUS
 from .models import PrintShop, PrintShopGroup, PrintShopUser, PrintShopPriceList
+from .pagination import keyset_page
 from .token import validate_confirmation_token, confirmation_token
 
+from products.matcher import suggest_products
+
+import json, math
+
+# Most products suggested per photo
+MAX_PHOTO_SUGGESTIONS = getattr(settings, 'MAX_PHOTO_SUGGESTIONS', 20)
+
+# Most photos matched in one request
+MAX_MATCH_PHOTOS = getattr(settings, 'MAX_MATCH_PHOTOS', 100)
+
+# Print shops listed per page of the directory
+PRINTSHOP_PAGE_SIZE = getattr(settings, 'PRINTSHOP_PAGE_SIZE', 25)
+
+# Staff listed per page of the print shop user list
+STAFF_PAGE_SIZE = getattr(settings, 'STAFF_PAGE_SIZE', 50)
+
+# Most users offered by the staff user search
+USER_SEARCH_LIMIT = getattr(settings, 'USER_SEARCH_LIMIT', 20)
+
 User = get_user_model()
 current_site = Site.objects.get_current()
 
@@ -126,6 +150,50 @@ class ListPrintShopView(ListView):
     template_name = 'printshop/list.html'
     model = PrintShop
 
+    """Filter the shops, then seek to the page after ?after= or before ?before= on (name, id)"""
+    def get_queryset(self):
+        self.filter = PrintShopFilter(self.request.GET, queryset=PrintShop.objects.all())
+        try:
+            self.page = keyset_page(self.filter.qs, ('name', 'id'), PRINTSHOP_PAGE_SIZE,
+                                    after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        except ValueError:
+            raise Http404
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super(ListPrintShopView, self).get_context_data(**kwargs)
+        context['filter'] = self.filter
+        context['page'] = self.page
+
+        # Page links keep the filters
+        for name, cursor in (('after', self.page.next_cursor), ('before', self.page.previous_cursor)):
+            if cursor:
+                query = self.request.GET.copy()
+                query.pop('after', None)
+                query.pop('before', None)
+                query[name] = cursor
+                context[name + '_query'] = query.urlencode()
+        return context
+
+
+"""List the print shops nearest the visitor, whose browser location is sent as ?lat=&lon="""
+class NearbyPrintShopView(View):
+    template_name = 'printshop/nearby.html'
+    radii = (5, 10, 25, 50, 100, 250, 500)
+
+    def get(self, request, *args, **kwargs):
+        context = {'searched': 'lat' in request.GET and 'lon' in request.GET, 'radius': NEARBY_SHOP_RADIUS,
+                   'radii': [km for km in self.radii if km <= NEARBY_SHOP_MAX_RADIUS]}
+        if context['searched']:
+            form = NearbySerializer(data=request.GET)
+            if form.is_valid():
+                query = form.validated_data
+                context.update(query, shops=PrintShop.nearby(query['lat'], query['lon'],
+                                                             query['radius'], query['limit']))
+            else:
+                context['errors'] = form.errors
+        return render(request, self.template_name, context)
+
 
 """View print shop in detail"""
 class DetailedPrintShopView(DetailView):
@@ -142,18 +210,103 @@ class DetailedPrintShopView(DetailView):
                 messages.error(self.request, mark_safe('Shop Email address must be confirmed to prevent automatic deactivation. Check your email urgently! <a href="{}" class="btn btn-danger">Resend Confirmation Email</a>'.format(reverse('print_shop_email_confirm', kwargs={'slug': self.object.slug}))))
 
         # Add to context if current user is active admin or active staff.
-        user_group = PrintShopGroup.objects.get(printshop=context['printshop'])
+        user_group = context['printshop'].staff_group
         context['admin_user'] = user_group.is_admin(self.request.user)
         context['staff_user'] = user_group.is_member(self.request.user)
 
         # Add to context all staff, only if current user is group member or staff user
         context['staff'] = None
-        if user_group.is_member(self.request.user) or self.request.user.is_staff:
+        if context['staff_user'] or self.request.user.is_staff:
             context['staff'] = user_group.member_set()
 
         return context
 
 
+"""Suggest the shop's products that fit each of a batch of customer photos"""
+class MatchPhotosView(View):
+    def post(self, request, **kwargs):
+        printshop = get_object_or_404(PrintShop, slug=self.kwargs['slug'])
+
+        try:
+            data = json.loads(self.request.body.decode())
+            photos = [(float(photo['width']), float(photo['height']), int(photo.get('orientation', 1)))
+                      for photo in data['photos']]
+            limit = int(data.get('limit', 5))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({'is_valid': False, 'error': 'Expected a list of photo dimensions.'}, status=400)
+
+        if not 1 <= len(photos) <= MAX_MATCH_PHOTOS:
+            return JsonResponse({'is_valid': False,
+                                 'error': 'Between 1 and {} photos can be matched at once.'.format(MAX_MATCH_PHOTOS)}, status=400)
+        if not all(0 < width < math.inf and 0 < height < math.inf for width, height, orientation in photos):
+            return JsonResponse({'is_valid': False, 'error': 'Photo dimensions must be positive.'}, status=400)
+        if not 1 <= limit <= MAX_PHOTO_SUGGESTIONS:
+            return JsonResponse({'is_valid': False,
+                                 'error': 'Limit must be between 1 and {}.'.format(MAX_PHOTO_SUGGESTIONS)}, status=400)
+
+        return JsonResponse({
+            'is_valid': True,
+            'suggestions': suggest_products(photos, printshop.image_slots(), limit),
+        })
+
+
+"""A page of the shop's staff as JSON, for shop admins.
+
+Members and their users are read with one joined query, in member_set()
+order. The group's date_updated versions the list as its ETag.
+"""
+@method_decorator(login_required, name='dispatch')
+class PrintShopUserListView(View):
+    def get(self, request, **kwargs):
+        printshop = get_object_or_404(PrintShop, slug=self.kwargs['slug'])
+        if not printshop.is_shop_admin(self.request.user):
+            raise Http404
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            raise Http404
+
+        group = printshop.staff_group
+        etag = quote_etag('{}-{}'.format(group.date_updated.timestamp(), page))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            start = (page - 1) * STAFF_PAGE_SIZE
+            staff = list(group.member_set().select_related('user').order_by('user', 'pk')[start:start + STAFF_PAGE_SIZE + 1])
+            response = JsonResponse({
+                'page': page,
+                'next': page + 1 if len(staff) > STAFF_PAGE_SIZE else None,
+                'staff': [{
+                    'id': member.id,
+                    'name': member.user.name,
+                    'email': member.user.email,
+                    'admin': member.admin,
+                    'creator': member.creator,
+                    'order_notifications': member.order_notifications,
+                    'customer_notifications': member.customer_notifications,
+                    'service_notifications': member.service_notifications,
+                    'active': member.user.is_active,
+                } for member in staff[:STAFF_PAGE_SIZE]],
+            })
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+"""Active users, not yet on the shop's staff, whose email or name starts with ?q="""
+@method_decorator(login_required, name='dispatch')
+class PrintShopUserSearchView(View):
+    def get(self, request, **kwargs):
+        printshop = get_object_or_404(PrintShop, slug=self.kwargs['slug'])
+        if not printshop.is_shop_admin(self.request.user):
+            raise Http404
+
+        users = User.objects.search(self.request.GET.get('q', '')) \
+                            .exclude(id__in=printshop.staff_group.member_set().values('user')) \
+                            .order_by('email_search')[:USER_SEARCH_LIMIT]
+        return JsonResponse({'users': [{'id': pk, 'email': email, 'name': name}
+                                       for pk, email, name in users.values_list('pk', 'email', 'name')]})
+
+
 """Users for shops"""
 @method_decorator(login_required, name='dispatch')
 class PrintShopUserView(View):
@@ -168,7 +321,7 @@ class PrintShopUserView(View):
             raise Http404
 
         # Get all the staff
-        staff_group = PrintShopGroup.objects.get(printshop=printshop)
+        staff_group = printshop.staff_group
         staff_users = staff_group.member_set()
 
         return render(self.request, self.template_name, {
@@ -185,62 +338,26 @@ class PrintShopUserView(View):
         if 'action' in self.request.POST:
             slug = self.kwargs['slug']
             printshop = get_object_or_404(PrintShop, slug=slug)
-            printshopusers =  PrintShopGroup.objects.get(printshop=printshop).member_set()
 
             # Render a 404 page if request.user is not a shop admin
             if not printshop.is_shop_admin(self.request.user):
                 raise Http404
 
-            """List print shop users"""
-            if self.request.POST['action'] == 'LIST':
-                list = ''
-                for staff in printshopusers:
-                    listrow = '<tr class="row-edit {}" data-id="{}"><td>{}</td><td>{}</td>'.format(
-                            'table-success' if staff.admin else '' if staff.user.is_active else 'table-danger',
-                            staff.id, staff.user.name, staff.user.email)
-
-                    listrow += '<td>{}{}</td><td>{}{}{}</td><td>{}</td>'.format(
-                            staff.admin,
-                            '<br/>Creator' if staff.creator else '',
-                            'Customer Orders<br/>' if staff.order_notifications else '',
-                            'Customer Queries<br/>' if staff.customer_notifications else '',
-                            'Service Notices' if staff.service_notifications else '',
-                            'Active' if staff.user.is_active else 'Disabled')
-
-                    list += listrow
-                return HttpResponse(list)
-
-
-            """Get details for new user"""
-            if self.request.POST['action'] == 'NEW':
-                # Get the unselected users for the user select field
-                existing = PrintShopGroup.objects.get(printshop=printshop).member_set().values_list('user')
-                users = User.objects.filter(is_active=True).exclude(id__in=existing)
-
-                data = {
-                    'userlist': serializers.serialize('json', users, fields=["email"]),
-                }
-
-
             """Get user shop user details for editing"""
             if self.request.POST['action'] == 'EDIT':
-                printshopuser = get_object_or_404(PrintShopUser, id=self.request.POST['id'])
-
-                # Get the unselected users for the user select field
-                existing = PrintShopGroup.objects.get(printshop=printshop).member_set().exclude(user=printshopuser.user).values_list('user')
-                #existing = PrintShopUser.objects.filter(printshop=printshop).exclude(user=printshopuser.user).values_list('user')
-                users = User.objects.filter(is_active=True).exclude(id__in=existing)
+                printshopuser = get_object_or_404(PrintShopUser.objects.select_related('user'),
+                                                  id=self.request.POST['id'], group=printshop.staff_group)
 
                 data = {
                     'id': printshopuser.id,
                     'user': printshopuser.user.id,
+                    'email': printshopuser.user.email,
                     'admin': printshopuser.admin,
                     'creator': printshopuser.creator,
                     'active': printshopuser.user.is_active,
                     'order_notifications': printshopuser.order_notifications,
                     'customer_notifications': printshopuser.customer_notifications,
                     'service_notifications': printshopuser.service_notifications,
-                    'userlist': serializers.serialize('json', users, fields=["email"]),
                 }
 
 
@@ -1,8 +1,9 @@
 from django.contrib import admin
 
-from .models import ProductFigure, ProductCategory, Product, ProductImage
+from .models import Blob, ProductFigure, ProductCategory, Product, ProductImage
 
 admin.site.register(ProductFigure)
 admin.site.register(ProductCategory)
 admin.site.register(Product)
 admin.site.register(ProductImage)
+admin.site.register(Blob)
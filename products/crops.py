@@ -0,0 +1,149 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from PIL import Image
+
+import numpy as np
+
+from .imaging import decoding, open_image
+from .matcher import fit_ratio
+from .photos import read_header, read_orientation
+from .renditions import PREVIEW_ROOT, TOUCH_INTERVAL, note_written
+
+import hashlib, math, os, time
+
+# Bounding box of the rendered crop previews
+PREVIEW_SIZE = getattr(settings, 'CROP_PREVIEW_SIZE', (300, 300))
+
+# Most photos previewed in one request
+MAX_PREVIEW_PHOTOS = getattr(settings, 'MAX_PREVIEW_PHOTOS', 20)
+
+
+# Transpose operations that display a photo of each EXIF orientation upright
+ORIENTATION_TRANSPOSE = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.TRANSPOSE,),
+    6: (Image.ROTATE_270,),
+    7: (Image.TRANSVERSE,),
+    8: (Image.ROTATE_90,),
+}
+
+
+"""Centred crop boxes fitting a batch of photos to their slots.
+
+sizes is a sequence of displayed (width, height) and slots the ProductImage
+each photo is assigned to. Returns an (n, 4) integer array of
+(left, top, right, bottom) boxes in displayed coordinates, and an (n,)
+boolean array set where a rotatable slot was turned to fit the photo.
+"""
+def plan_crops(sizes, slots):
+    sizes = np.asarray(sizes, dtype=float).reshape(-1, 2)
+    width, height = sizes.T
+    ratio = np.asarray([float(slot.ratio) for slot in slots])
+    rotatable = np.asarray([slot.rotatable for slot in slots], dtype=bool)
+
+    photo_ratio = width / height
+    ratio, turned = fit_ratio(photo_ratio, ratio, rotatable)
+
+    # Wider photos keep their height, taller ones their width
+    wider = photo_ratio > ratio
+    crop_width = np.where(wider, height * ratio, width)
+    crop_height = np.where(wider, height, width / ratio)
+    left = (width - crop_width) / 2
+    top = (height - crop_height) / 2
+
+    boxes = np.stack((left, top, left + crop_width, top + crop_height), axis=1)
+    return np.rint(boxes).astype(int), turned
+
+
+def preview_name(path, box):
+    stat = os.stat(path)
+    key = hashlib.sha1('{}:{}:{}:{}:{}'.format(path, stat.st_mtime, stat.st_size, tuple(box),
+                                               tuple(PREVIEW_SIZE)).encode()).hexdigest()
+    return '/'.join((PREVIEW_ROOT, key[:2], key + '.jpg'))
+
+
+"""Render the preview of the box of the photo at path.
+
+Runs inside the preview process pool. JPEGs are decoded at the smallest DCT
+scale that still covers the preview, so a 24 MP photo is never fully decoded
+for a 300 px preview. Returns the storage name of the preview.
+"""
+def render_preview(path, box):
+    name = preview_name(path, box)
+    output = default_storage.path(name)
+    try:
+        # Record the use for LRU eviction
+        if os.stat(output).st_mtime < time.time() - TOUCH_INTERVAL:
+            os.utime(output)
+        return name
+    except FileNotFoundError:
+        pass
+
+    image = open_image(path)
+    orientation = read_orientation(image)
+    width, height = image.size
+
+    # Scale needed for the crop, mapped back to the stored orientation
+    left, top, right, bottom = box
+    scale = min(1, PREVIEW_SIZE[0] / max(right - left, 1), PREVIEW_SIZE[1] / max(bottom - top, 1))
+    image.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+    factor = image.size[0] / width
+
+    with decoding(image):
+        for operation in ORIENTATION_TRANSPOSE.get(orientation, ()):
+            image = image.transpose(operation)
+
+        image = image.crop(tuple(int(round(value * factor)) for value in box))
+        image.thumbnail(PREVIEW_SIZE, Image.ANTIALIAS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    temp = '{}.{}.tmp'.format(output, os.getpid())
+    image.save(temp, format='JPEG', quality=85)
+    os.replace(temp, output)
+    return name
+
+
+"""Render the previews of many (path, box) pairs, in a process pool when worthwhile"""
+def render_previews(paths, boxes, processes=None):
+    boxes = [tuple(int(value) for value in box) for box in boxes]
+    missing = [name for name in (preview_name(path, box) for path, box in zip(paths, boxes))
+               if not default_storage.exists(name)]
+    if processes == 1 or len(paths) < 2:
+        names = [render_preview(path, box) for path, box in zip(paths, boxes)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            names = list(pool.map(render_preview, paths, boxes))
+
+    # Previews count towards the rendition cache budget
+    note_written(sum(default_storage.size(name) for name in set(missing)))
+    return names
+
+
+"""Plan the crops of a whole order and render their previews.
+
+assignments is a sequence of (photo path, ProductImage). Returns a dict per
+assignment with the slot, crop box, whether the slot was turned and the
+storage name of the preview.
+"""
+def plan_order(assignments, processes=None):
+    assignments = list(assignments)
+    if not assignments:
+        return []
+
+    paths = [path for path, slot in assignments]
+    slots = [slot for path, slot in assignments]
+    boxes, turned = plan_crops([read_header(path) for path in paths], slots)
+    previews = render_previews(paths, boxes, processes)
+
+    return [{
+        'slot': slot.pk,
+        'box': tuple(int(value) for value in box),
+        'turned': bool(turn),
+        'preview': preview,
+    } for slot, box, turn, preview in zip(slots, boxes, turned, previews)]
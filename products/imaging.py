@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from django.conf import settings
+
+from PIL import Image
+
+import resource, threading
+
+# Largest image, in pixels, that is decoded at all
+MAX_IMAGE_PIXELS = getattr(settings, 'MAX_IMAGE_PIXELS', 120 * 1000000)
+
+# Pixels decoded at the same time by all threads of a process
+IMAGE_PIXEL_BUDGET = getattr(settings, 'IMAGE_PIXEL_BUDGET', 250 * 1000000)
+
+# Pillow refuses anything over twice its own limit before reading any pixel data
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+"""Process-wide budget of decoded pixels.
+
+Decodes wait until their pixels fit in the budget. An image larger than the
+whole budget waits until nothing else is decoding and then runs alone.
+"""
+class PixelBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.decoded = 0
+        self.waits = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, pixels):
+        pixels = min(pixels, self.limit)
+        with self.condition:
+            if self.in_use and self.in_use + pixels > self.limit:
+                self.waits += 1
+                while self.in_use and self.in_use + pixels > self.limit:
+                    self.condition.wait()
+            self.in_use += pixels
+            self.peak = max(self.peak, self.in_use)
+            self.decoded += 1
+        return pixels
+
+    def release(self, pixels):
+        with self.condition:
+            self.in_use -= pixels
+            self.condition.notify_all()
+
+
+budget = PixelBudget(IMAGE_PIXEL_BUDGET)
+
+
+"""Open an image, reading its headers only.
+
+Raises Image.DecompressionBombError when the image is over MAX_IMAGE_PIXELS.
+Call draft() on the result to decode a JPEG at a reduced scale, then decode
+it inside decoding().
+"""
+def open_image(fp):
+    image = Image.open(fp)
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise Image.DecompressionBombError(
+                'Image size ({} pixels) exceeds limit of {} pixels'.format(width * height, MAX_IMAGE_PIXELS))
+    return image
+
+
+"""Hold the pixel budget while the image is decoded and processed"""
+@contextmanager
+def decoding(image):
+    width, height = image.size
+    pixels = budget.acquire(width * height)
+    try:
+        yield image
+    finally:
+        budget.release(pixels)
+
+
+"""Open an image and reduce it towards size, decoding within the budget"""
+@contextmanager
+def open_reduced(fp, size, mode=None):
+    image = open_image(fp)
+    image.draft(mode, size)
+    with decoding(image):
+        yield image
+
+
+"""Decode counters and peak memory of this process and its finished workers"""
+def metrics():
+    return {
+        'decoded': budget.decoded,
+        'waits': budget.waits,
+        'in_use_megapixels': round(budget.in_use / 1000000, 1),
+        'peak_megapixels': round(budget.peak / 1000000, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children_max_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
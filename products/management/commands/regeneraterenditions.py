@@ -0,0 +1,113 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from PIL import Image
+
+from products.imaging import metrics
+from products.renditions import RENDITION_SIZES, build_renditions, evict
+from products.storage import IMAGE_FIELDS
+
+import json, os, time
+
+
+"""Rebuild the renditions of one image, returns (bytes read, bytes written)"""
+def regenerate(path, size_names, force):
+    try:
+        return os.path.getsize(path), build_renditions(path, size_names, force)
+    except (IOError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the renditions of every figure and shop logo, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of worker processes')
+        parser.add_argument('--chunk', type=int, default=500,
+                            help='Rows read per keyset page')
+        parser.add_argument('--size', action='append', dest='sizes', choices=sorted(RENDITION_SIZES),
+                            help='Only regenerate this size, may be repeated')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild renditions that already exist')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, '.regeneraterenditions.json'),
+                            help='File recording the progress of the run')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the beginning')
+
+    def handle(self, *args, **options):
+        self.checkpoint = options['checkpoint']
+        progress = {} if options['restart'] else self.load_checkpoint()
+        if progress:
+            self.stdout.write('Resuming from {}'.format(self.checkpoint))
+
+        self.started = time.time()
+        self.images = self.failed = self.bytes_in = self.bytes_out = 0
+        seen = set()
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+            for label, field in IMAGE_FIELDS:
+                model = apps.get_model(label)
+                storage = model._meta.get_field(field).storage
+                last = progress.get(label, 0)
+
+                while True:
+                    rows = list(model.objects.filter(pk__gt=last).exclude(**{field: ''})
+                                .order_by('pk').values_list('pk', field)[:options['chunk']])
+                    if not rows:
+                        break
+
+                    # Shared uploads are only rendered once per run
+                    paths = []
+                    for pk, name in rows:
+                        if name not in seen:
+                            seen.add(name)
+                            paths.append(storage.path(name))
+
+                    results = pool.map(regenerate, paths,
+                                       [options['sizes']] * len(paths), [options['force']] * len(paths))
+                    for result in results:
+                        if result is None:
+                            self.failed += 1
+                        else:
+                            self.images += 1
+                            self.bytes_in += result[0]
+                            self.bytes_out += result[1]
+
+                    last = rows[-1][0]
+                    progress[label] = last
+                    self.save_checkpoint(progress)
+                    self.report(label, last)
+
+        evict()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        self.stdout.write('Peak memory: {children_max_rss_mb} MB per worker, {max_rss_mb} MB main process'.format(**metrics()))
+        self.stdout.write(self.style.SUCCESS('Regenerated {} images, {} failed'.format(self.images, self.failed)))
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            raise CommandError('Checkpoint {} is corrupt, run with --restart'.format(self.checkpoint))
+
+    def save_checkpoint(self, progress):
+        temp = '{}.tmp'.format(self.checkpoint)
+        with open(temp, 'w') as f:
+            json.dump(progress, f)
+        os.replace(temp, self.checkpoint)
+
+    def report(self, label, last):
+        elapsed = max(time.time() - self.started, 0.001)
+        self.stdout.write('{} up to pk {}: {} images, {:.1f} images/s, {:.1f} MB in, {:.1f} MB out, {} failed'.format(
+                          label, last, self.images, self.images / elapsed,
+                          self.bytes_in / 1048576, self.bytes_out / 1048576, self.failed))
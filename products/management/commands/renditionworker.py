@@ -0,0 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products.models import ProductFigure
+from products.renditions import build_renditions, evict
+
+import os, time
+
+
+class Command(BaseCommand):
+    help = 'Render pending product figures in a background process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of worker processes')
+        parser.add_argument('--batch', type=int, default=50,
+                            help='Figures claimed per polling cycle')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep when nothing is pending')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no figures are pending')
+        parser.add_argument('--requeue', action='store_true',
+                            help='First put figures left rendering by a worker that was killed back in the queue')
+
+    def handle(self, *args, **options):
+        # Forked workers must not share the parent's database connection
+        if options['requeue']:
+            requeued = ProductFigure.objects.filter(status=ProductFigure.RENDERING).update(status=ProductFigure.PENDING)
+            self.stdout.write('{} figures requeued'.format(requeued))
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+            while True:
+                processed = self.process_batch(pool, options['batch'])
+                if processed:
+                    # Keep the rendition cache within its budget off the request path
+                    evict()
+                else:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+
+    # Claim a pending figure, False when another worker got to it first
+    def claim(self, figure):
+        return bool(ProductFigure.objects.filter(pk=figure.pk, image=figure.image.name, status=ProductFigure.PENDING)
+                    .update(status=ProductFigure.RENDERING))
+
+    def process_batch(self, pool, batch):
+        figures = [figure for figure in ProductFigure.objects.filter(status=ProductFigure.PENDING).order_by('pk')[:batch]
+                   if self.claim(figure)]
+        futures = {pool.submit(build_renditions, figure.image.path): figure for figure in figures}
+
+        try:
+            for future in as_completed(futures):
+                figure = futures.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    self.stderr.write('Cannot render {}: {}'.format(figure.image.name, e))
+                    status = ProductFigure.FAILED
+                else:
+                    status = ProductFigure.READY
+
+                # Only switch over if the image was not replaced while rendering
+                ProductFigure.objects.filter(pk=figure.pk, image=figure.image.name,
+                                             status=ProductFigure.RENDERING).update(status=status)
+        finally:
+            # Give back the claims of figures not rendered, i.e. when interrupted
+            ProductFigure.objects.filter(pk__in=[figure.pk for figure in futures.values()],
+                                         status=ProductFigure.RENDERING).update(status=ProductFigure.PENDING)
+
+        return len(figures)
@@ -0,0 +1,97 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from products.models import Blob
+from products.storage import IMAGE_FIELDS, image_roots
+
+import os, time
+
+
+class Command(BaseCommand):
+    help = 'Find, and unless --dry-run delete, uploaded figure and logo files no record refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the orphaned files')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Leave files modified in the last seconds, i.e. uploads in progress')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        roots = image_roots()
+
+        # Stream the referenced names without loading model instances
+        for label, field in IMAGE_FIELDS:
+            model = apps.get_model(label)
+            names = model.objects.exclude(**{field: ''}).values_list(field, flat=True)
+            referenced.update(names.iterator(chunk_size=10000))
+
+        self.cutoff = time.time() - options['min_age']
+        self.options = options
+        self.orphans = self.reclaimed = 0
+        scanned = 0
+        batch = []
+
+        for root, storage in sorted(roots.items()):
+            base = storage.path('')
+            stack = [storage.path(root)]
+            while stack:
+                try:
+                    entries = os.scandir(stack.pop())
+                except FileNotFoundError:
+                    continue
+                with entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+
+                        scanned += 1
+                        name = os.path.relpath(entry.path, base).replace(os.sep, '/')
+                        stat = entry.stat(follow_symlinks=False)
+                        if name in referenced or stat.st_mtime > self.cutoff:
+                            continue
+
+                        batch.append((name, entry.path, stat.st_size))
+                        if len(batch) >= 500:
+                            self.sweep(batch)
+
+        self.sweep(batch)
+        self.stdout.write(self.style.SUCCESS('{} {} orphaned files of {} scanned, {:.1f} MB'.format(
+                          'Found' if options['dry_run'] else 'Deleted', self.orphans, scanned, self.reclaimed / 1048576)))
+
+    """Delete a batch of candidate orphans that are still unreferenced.
+
+    The referenced names were read before the scan, so each batch is checked
+    against the records again and every file is stat'ed again right before it
+    goes. An upload that reused the content of an old orphan in the meantime
+    has a new record or a fresh mtime, and is left alone.
+    """
+    def sweep(self, batch):
+        if not batch:
+            return
+        names = [name for name, path, size in batch]
+        live = set()
+        for label, field in IMAGE_FIELDS:
+            live.update(apps.get_model(label).objects.filter(**{field + '__in': names})
+                                                     .values_list(field, flat=True))
+
+        removed = []
+        for name, path, size in batch:
+            try:
+                if name in live or os.stat(path).st_mtime > self.cutoff:
+                    continue
+                if not self.options['dry_run']:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed.append(name)
+            self.orphans += 1
+            self.reclaimed += size
+            if self.options['verbosity'] > 1:
+                self.stdout.write(name)
+
+        # Drop the reference counts of deleted content addressed files
+        if removed and not self.options['dry_run']:
+            Blob.objects.filter(name__in=removed).delete()
+        del batch[:]
@@ -0,0 +1,91 @@
+import numpy as np
+
+from .photos import CROP_WARN, OK, REJECT, ROTATED, WARN
+
+# Status codes used in the fit matrix, ordered from best to worst
+STATUSES = (OK, WARN, REJECT)
+
+
+"""Slot ratio used for photos of photo_ratio, turned where a rotatable slot
+matches the photo orientation better. Returns (ratio, turned) arrays.
+"""
+def fit_ratio(photo_ratio, ratio, rotatable):
+    turned = np.asarray(rotatable).astype(bool) & ((photo_ratio >= 1) != (ratio >= 1))
+    return np.where(turned, 1 / ratio, ratio), turned
+
+
+"""Fit every photo against every product image slot in one NumPy pass.
+
+photos is a sequence of (width, height, exif orientation) and slots a sequence
+of (slot id, product id, ratio, rotatable, min megapixels, warn megapixels), as
+returned by values_list() on ProductImage. Applies the same rule as
+photos.check_slot() and returns (status, crop_loss, megapixels) arrays of
+shape (photos, slots), status holding indexes into STATUSES.
+"""
+def fit_matrix(photos, slots):
+    photos = np.asarray(photos, dtype=float).reshape(-1, 3)
+    width, height, orientation = photos.T
+    turned = np.isin(orientation, ROTATED)
+    width, height = np.where(turned, height, width), np.where(turned, width, height)
+    valid = (width > 0) & (height > 0)
+
+    columns = np.asarray([slot[2:6] for slot in slots], dtype=float).reshape(-1, 4)
+    ratio, rotatable, min_megapixels, warn_megapixels = columns.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        photo_ratio = np.where(valid, width / height, 1)[:, None]
+        ratio = fit_ratio(photo_ratio, ratio, rotatable)[0]
+        crop_loss = 1 - np.minimum(photo_ratio, ratio) / np.maximum(photo_ratio, ratio)
+
+    megapixels = (width * height / 1000000)[:, None] * (1 - crop_loss)
+    status = np.where((megapixels < min_megapixels) | ~valid[:, None], 2,
+                      np.where((megapixels < warn_megapixels) | (crop_loss > CROP_WARN), 1, 0))
+    return status, crop_loss, megapixels
+
+
+"""Rank the products that fit each photo.
+
+Every product is scored by its best fitting slot, on status first and crop
+loss second. Returns a list per photo of at most limit suggestions, best
+first, leaving out products whose every slot rejects the photo.
+"""
+def suggest_products(photos, slots, limit=5):
+    slots = list(slots)
+    photo_count = len(photos)
+    if not slots or not photo_count:
+        return [[] for photo in range(photo_count)]
+
+    status, crop_loss, megapixels = fit_matrix(photos, slots)
+    score = status + crop_loss
+
+    # Lay the slot columns of each product out in a padded products x slots grid
+    slot_ids = np.asarray([slot[0] for slot in slots])
+    products, owner = np.unique([slot[1] for slot in slots], return_inverse=True)
+    counts = np.bincount(owner)
+    order = np.argsort(owner, kind='stable')
+    position = np.arange(len(slots)) - np.repeat(np.cumsum(counts) - counts, counts)
+    grid = np.full((len(products), counts.max()), -1)
+    grid[owner[order], position] = order
+
+    # Best slot of every product for every photo
+    padded = np.where(grid >= 0, score[:, grid], np.inf)
+    best = grid[np.arange(len(products)), padded.argmin(axis=2)]
+    best_score = np.take_along_axis(score, best, axis=1)
+    ranking = np.argsort(best_score, axis=1, kind='stable')[:, :limit]
+
+    suggestions = []
+    for row, columns in enumerate(ranking):
+        photo = []
+        for product in columns:
+            slot = best[row, product]
+            if status[row, slot] == 2:
+                break
+            photo.append({
+                'product': int(products[product]),
+                'slot': int(slot_ids[slot]),
+                'status': STATUSES[status[row, slot]],
+                'crop_loss': round(float(crop_loss[row, slot]), 4),
+                'megapixels': round(float(megapixels[row, slot]), 2),
+            })
+        suggestions.append(photo)
+    return suggestions
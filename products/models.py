@@ -4,31 +4,76 @@ from django.db import models
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 
-from PIL import Image
-
-import io
+from .renditions import rendition_url
+from .storage import blob_storage
 
 User = get_user_model()
 
+"""Distinct uploaded figure and logo files, shared by every record with the same content"""
+class Blob(models.Model):
+    name = models.CharField(_('Name'), max_length=255, unique=True)
+    size = models.PositiveIntegerField(_('Size'))
+    references = models.PositiveIntegerField(_('References'), default=1)
+
+    def __str__(self):
+        return self.name
+
+
 """Images of products to use online"""
 class ProductFigure(models.Model):
-    image = models.ImageField(_('Product Figure'), upload_to='figures/%Y/%m/%d/')
+    PENDING = 'P'
+    RENDERING = 'B'
+    READY = 'R'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (RENDERING, _('Rendering')),
+        (READY, _('Ready')),
+        (FAILED, _('Failed')),
+    )
+
+    image = models.ImageField(_('Product Figure'), upload_to='figures/%Y/%m/%d/',
+                              storage=blob_storage)
+    status = models.CharField(_('Status'), max_length=1, choices=STATUS_CHOICES,
+                              default=PENDING, editable=False)
     public = models.BooleanField(_('Avaliable to All'), default=False)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True,
                               on_delete=models.SET_NULL)
 
-    def resize_figure(self, size=(256, 256)):
-        try:
-            image = Image.open(self.image.path)
-            image.thumbnail(size, Image.ANTIALIAS)
-            image.save(self.image.path)
-        except IOError:
-            print("Cannot resize", self.image.name)
-
-    # AFTER saving, resive the image and overwrite
+    # A new image is left pending, the renditionworker command resizes it
     def save(self, *args, **kwargs):
+        if self.pk:
+            old_image = ProductFigure.objects.filter(pk=self.pk).values_list('image', flat=True).first()
+        else:
+            old_image = None
+
+        # An upload takes a new reference even when its content is already stored
+        uploaded = bool(self.image) and not self.image._committed
+
+        if old_image != self.image.name:
+            self.status = self.PENDING
         super().save(*args,**kwargs)
-        self.resize_figure()
+
+        # Release the replaced image, it is only removed once no longer shared
+        if old_image and (old_image != self.image.name or uploaded):
+            self.image.storage.delete(old_image)
+
+    # Serve a rendition once the worker has finished with it, the original otherwise
+    def sized_url(self, size_name):
+        if self.status == self.READY:
+            return rendition_url(self.image, size_name)
+        return self.image.url
+
+    @property
+    def display_url(self):
+        return self.sized_url('thumb')
+
+    @property
+    def card_url(self):
+        return self.sized_url('card')
+
+    def is_pending(self):
+        return self.status in (self.PENDING, self.RENDERING)
 
     def __str__(self):
         return self.image.name
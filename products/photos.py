@@ -0,0 +1,100 @@
+from PIL import Image
+
+from .imaging import open_image
+
+# Photo classification against a product image slot
+OK = 'ok'
+WARN = 'warn'
+REJECT = 'reject'
+
+# Share of the photo lost to cropping above which the customer is warned
+CROP_WARN = 0.2
+
+# EXIF orientations that rotate the photo by 90 degrees
+EXIF_ORIENTATION = 0x0112
+ROTATED = (5, 6, 7, 8)
+
+
+"""EXIF orientation of an opened image, 1 when it has none"""
+def read_orientation(image):
+    getexif = getattr(image, '_getexif', None)
+    if getexif is None:
+        return 1
+    try:
+        return (getexif() or {}).get(EXIF_ORIENTATION, 1)
+    except Exception:
+        # Corrupt EXIF block, treat the photo as unrotated
+        return 1
+
+
+"""Read the displayed width and height of a photo from its headers only.
+
+Image.open() parses the headers lazily and the pixel data is never decoded,
+so this runs in constant memory whatever the size of the photo. Returns
+(width, height) with the EXIF orientation applied.
+"""
+def read_header(fp):
+    image = open_image(fp)
+    width, height = image.size
+    if read_orientation(image) in ROTATED:
+        width, height = height, width
+    return width, height
+
+
+"""Classify a photo of width x height against a ProductImage slot.
+
+The photo is cropped to the slot ratio, turned if the slot is rotatable, and
+the megapixels left after the crop are compared to the slot thresholds.
+"""
+def check_slot(width, height, slot):
+    photo_ratio = width / height
+    ratio = float(slot.ratio)
+    if slot.rotatable and (photo_ratio >= 1) != (ratio >= 1):
+        ratio = 1 / ratio
+
+    crop_loss = 1 - min(photo_ratio, ratio) / max(photo_ratio, ratio)
+    megapixels = width * height * (1 - crop_loss) / 1000000
+
+    if megapixels < float(slot.min_megapixels):
+        status = REJECT
+    elif megapixels < float(slot.warn_megapixels) or crop_loss > CROP_WARN:
+        status = WARN
+    else:
+        status = OK
+
+    return {
+        'slot': slot.pk,
+        'status': status,
+        'megapixels': round(megapixels, 2),
+        'crop_loss': round(crop_loss, 4),
+    }
+
+
+"""Check one photo file against every image slot of a product"""
+def check_photo(fp, slots):
+    try:
+        width, height = read_header(fp)
+    except (IOError, SyntaxError, Image.DecompressionBombError) as e:
+        return {
+            'status': REJECT,
+            'error': str(e) or 'Cannot read image',
+            'slots': [],
+        }
+
+    results = [check_slot(width, height, slot) for slot in slots]
+    return {
+        'width': width,
+        'height': height,
+        'megapixels': round(width * height / 1000000, 2),
+        'status': best(result['status'] for result in results),
+        'slots': results,
+    }
+
+
+# Status of the best fitting slot, a photo without slots cannot be used
+def best(statuses):
+    statuses = set(statuses)
+    for status in (OK, WARN):
+        if status in statuses:
+            return status
+    return REJECT
@@ -0,0 +1,293 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from PIL import Image, features
+
+from .imaging import decoding, open_image
+
+from functools import lru_cache
+import hashlib, io, os, re, time
+
+# Named bounding boxes that figures and logos are rendered at
+RENDITION_SIZES = getattr(settings, 'RENDITION_SIZES', {
+    'thumb': (256, 256),
+    'card': (640, 640),
+    'hero': (1600, 1600),
+})
+
+# Renditions are kept under MEDIA_ROOT/<RENDITION_ROOT>/<hash[:2]>/<hash>/<size>-<w>x<h>.<ext>,
+# so changing a size leaves the old renditions to be evicted
+RENDITION_ROOT = getattr(settings, 'RENDITION_ROOT', 'renditions')
+
+# Crop previews are kept under MEDIA_ROOT/<PREVIEW_ROOT>/<key[:2]>/<key>.jpg and share the disk budget
+PREVIEW_ROOT = getattr(settings, 'CROP_PREVIEW_ROOT', 'previews')
+
+# Disk budget of the rendition cache, least recently used files are evicted first
+RENDITION_CACHE_BYTES = getattr(settings, 'RENDITION_CACHE_BYTES', 512 * 1024 * 1024)
+
+# Only refresh the last-used time of a rendition once per period
+TOUCH_INTERVAL = 60 * 60
+
+# Renditions built on request run an eviction pass once this many bytes were written by the process
+EVICT_INTERVAL_BYTES = max(RENDITION_CACHE_BYTES // 20, 1)
+_written = 0
+
+# Encoders of the rendition formats, tuned for quality per byte
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', {'optimize': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+}
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+# WebP needs Pillow built against libwebp
+WEBP = features.check('webp')
+
+HASH_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+@lru_cache(maxsize=4096)
+def _file_hash(path, mtime, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+"""Content hash of the file at path, memoized while the file is unchanged"""
+def content_hash(path):
+    # Content addressed uploads are already named by their hash
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if HASH_NAME.match(stem):
+        return stem
+
+    stat = os.stat(path)
+    return _file_hash(path, stat.st_mtime, stat.st_size)
+
+
+def rendition_stem(size_name):
+    return '{}-{}x{}'.format(size_name, *RENDITION_SIZES[size_name])
+
+
+def rendition_name(key, size_name, extension):
+    return '/'.join((RENDITION_ROOT, key[:2], key, '{}.{}'.format(rendition_stem(size_name), extension)))
+
+
+# Size of an image of size fitted into the box, keeping its aspect ratio and never enlarged
+def fitted_size(size, box):
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+"""Resize the image at path to fit the named size.
+
+Images with transparency are encoded as PNG, all others as progressive JPEG,
+plus a WebP variant when Pillow supports it. The result is exactly
+fitted_size() of the original, as rendition_srcset() expects. Returns
+{extension: data}.
+"""
+def render_image(path, size_name):
+    image = open_image(path)
+    size = fitted_size(image.size, RENDITION_SIZES[size_name])
+    image.draft(None, size)
+    with decoding(image):
+        image = image.resize(size, Image.ANTIALIAS, reducing_gap=2.0)
+        if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+            image = image.convert('RGBA')
+            extensions = ['png']
+        else:
+            image = image.convert('RGB')
+            extensions = ['jpg']
+        if WEBP:
+            extensions.append('webp')
+
+        encoded = {}
+        for extension in extensions:
+            image_format, params = FORMATS[extension]
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format, **params)
+            encoded[extension] = buffer.getvalue()
+    return encoded
+
+
+def _write(name, data):
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial rendition
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+# Existing formats of a rendition, as {extension: DirEntry}
+def _find(key, size_name):
+    directory = default_storage.path('/'.join((RENDITION_ROOT, key[:2], key)))
+    stem = rendition_stem(size_name)
+    found = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name, dot, extension = entry.name.rpartition('.')
+                if name == stem and extension in FORMATS:
+                    found[extension] = entry
+    except FileNotFoundError:
+        pass
+    return found
+
+
+def _build(key, path, size_name):
+    written = 0
+    for extension, data in render_image(path, size_name).items():
+        _write(rendition_name(key, size_name, extension), data)
+        written += len(data)
+    return written
+
+
+"""Build every named rendition of the image at path.
+
+Used by the renditionworker and regeneraterenditions process pools to warm
+the cache, so it only touches the file system. Existing renditions are kept
+unless force is set. Returns the number of bytes written.
+"""
+def build_renditions(path, size_names=None, force=False):
+    key = content_hash(path)
+    written = 0
+    for size_name in size_names or RENDITION_SIZES:
+        if force or not _find(key, size_name):
+            written += _build(key, path, size_name)
+    return written
+
+
+# Extension served for the found formats, None when there is none to serve
+def _pick(found, webp):
+    if webp and 'webp' in found:
+        return 'webp'
+    return next((extension for extension in found if extension != 'webp'), None)
+
+
+"""Count bytes written on request, evicting once they pass EVICT_INTERVAL_BYTES.
+
+The eviction pass walks the whole cache, so it is amortised over many builds
+rather than run on every miss. The rendition worker evicts after each batch.
+"""
+def note_written(size):
+    global _written
+    _written += size
+    if _written >= EVICT_INTERVAL_BYTES:
+        _written = 0
+        evict()
+
+
+"""Storage name of the named rendition of the image at path, built on first request.
+
+Returns the WebP variant when webp is set and one exists, otherwise the
+JPEG or PNG.
+"""
+def get_rendition(path, size_name, webp=False):
+    key = content_hash(path)
+
+    found = _find(key, size_name)
+    extension = _pick(found, webp)
+    while extension is None:
+        written = _build(key, path, size_name)
+        found = _find(key, size_name)
+        extension = _pick(found, webp)
+        note_written(written)
+    entry = found[extension]
+
+    # Record the use for LRU eviction, the file may have just been evicted by another process
+    try:
+        if entry.stat().st_mtime < time.time() - TOUCH_INTERVAL:
+            os.utime(entry.path)
+    except FileNotFoundError:
+        pass
+    return rendition_name(key, size_name, extension)
+
+
+"""URL of the rendition view, which negotiates the format with the browser"""
+def rendition_url(fieldfile, size_name):
+    if not fieldfile:
+        return ''
+    return reverse('rendition', kwargs={'stem': rendition_stem(size_name), 'name': fieldfile.name})
+
+
+"""Open the named rendition of the image at path, building it again if evicted meanwhile.
+
+Returns the open file and its extension. Raises FileNotFoundError when the
+rendition cannot be kept long enough to be opened.
+"""
+def open_rendition(path, size_name, webp=False):
+    for attempt in range(2):
+        name = get_rendition(path, size_name, webp)
+        try:
+            return open(default_storage.path(name), 'rb'), os.path.splitext(name)[1][1:]
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+"""srcset of every named rendition, each described by the width it is rendered at.
+
+Small sources render at the same width for several sizes, only the smallest
+of those is listed. The box widths are used when the image can't be read.
+"""
+def rendition_srcset(fieldfile):
+    try:
+        source = fieldfile.width, fieldfile.height
+    except (IOError, ValueError):
+        source = None
+
+    widths = {}
+    for size_name, box in sorted(RENDITION_SIZES.items(), key=lambda item: item[1][0]):
+        width = fitted_size(source, box)[0] if source and all(source) else box[0]
+        widths.setdefault(width, size_name)
+    return ', '.join('{} {}w'.format(rendition_url(fieldfile, size_name), width)
+                     for width, size_name in widths.items())
+
+
+"""Delete the least recently used renditions and previews until the cache fits the disk budget"""
+def evict(budget=None):
+    budget = RENDITION_CACHE_BYTES if budget is None else budget
+
+    files = []
+    total = 0
+    stack = [default_storage.path(RENDITION_ROOT), default_storage.path(PREVIEW_ROOT)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+    removed = 0
+    if total > budget:
+        files.sort()
+        for mtime, size, path in files:
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # Directory still holds other sizes, or another process got there first
+                pass
+            total -= size
+            removed += 1
+    return removed
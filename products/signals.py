@@ -3,7 +3,7 @@ from django.dispatch import receiver
 
 from .models import ProductFigure
 
-"""Automatically delete images on delete of record to prevent orphaned files"""
+"""Release images on delete of record, the shared file is removed with its last reference"""
 @receiver(post_delete, sender=ProductFigure)
 def submission_delete(sender, instance, **kwargs):
     instance.image.delete(False)
@@ -0,0 +1,100 @@
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+import hashlib, os, tempfile
+
+# Model fields holding uploaded images, as (app_label.Model, field name)
+IMAGE_FIELDS = (
+    ('products.ProductFigure', 'image'),
+    ('printshops.PrintShop', 'logo'),
+)
+
+
+# Top directory of every image field's uploads, as {directory: storage}
+def image_roots():
+    roots = {}
+    for label, field in IMAGE_FIELDS:
+        model_field = apps.get_model(label)._meta.get_field(field)
+        roots[model_field.upload_to.split('/', 1)[0]] = model_field.storage
+    return roots
+
+
+"""Content addressed file storage.
+
+Each distinct upload is stored once as <prefix>/<hash[:2]>/<hash[2:4]>/<hash><ext>,
+where prefix is the first directory of the field's upload_to. A Blob row counts
+the references to every stored file and delete() only removes the file when
+the last reference goes away.
+"""
+class ContentAddressedStorage(FileSystemStorage):
+
+    # The final name is only known once the content has been hashed in _save
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        prefix = name.split('/', 1)[0]
+        extension = os.path.splitext(name)[1].lower()
+        directory = self.path(prefix)
+        os.makedirs(directory, exist_ok=True)
+
+        temp = tempfile.NamedTemporaryFile(dir=directory, prefix='.upload-', delete=False)
+        try:
+            # Hash while streaming the upload to a temporary file
+            digest = hashlib.sha256()
+            size = 0
+            with temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+
+            key = digest.hexdigest()
+            name = '/'.join((prefix, key[:2], key[2:4], key + extension))
+            path = self.path(name)
+
+            # Count the reference first, the write locks the row (the database on sqlite) so
+            # a delete of the last reference can't remove the file until this has committed
+            with transaction.atomic():
+                if not Blob.objects.filter(name=name).update(references=F('references') + 1):
+                    try:
+                        with transaction.atomic():
+                            Blob.objects.create(name=name, size=size)
+                    except IntegrityError:
+                        Blob.objects.filter(name=name).update(references=F('references') + 1)
+
+                if os.path.exists(path):
+                    # A fresh mtime keeps sweepmedia off content reused while it runs
+                    os.utime(path)
+                else:
+                    # New content, or a file lost from under its record
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp.name, path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+        finally:
+            try:
+                os.remove(temp.name)
+            except FileNotFoundError:
+                pass
+
+        return name
+
+    def delete(self, name):
+        from .models import Blob
+
+        # The file is removed while the row, or on sqlite the database, is locked by the first write
+        with transaction.atomic():
+            if Blob.objects.filter(name=name, references__gt=1).update(references=F('references') - 1):
+                return
+            Blob.objects.filter(name=name).delete()
+
+            # Last reference, or a file stored before deduplication
+            super().delete(name)
+
+
+blob_storage = ContentAddressedStorage()
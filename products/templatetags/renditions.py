@@ -0,0 +1,21 @@
+from django import template
+
+from products.renditions import rendition_srcset, rendition_url
+
+register = template.Library()
+
+
+"""URL of a named rendition, i.e. {{ object.logo|rendition:'card' }}"""
+@register.filter
+def rendition(fieldfile, size_name='thumb'):
+    if not fieldfile:
+        return ''
+    return rendition_url(fieldfile, size_name)
+
+
+"""srcset of every named rendition, i.e. srcset="{{ object.logo|srcset }}" """
+@register.filter
+def srcset(fieldfile):
+    if not fieldfile:
+        return ''
+    return rendition_srcset(fieldfile)
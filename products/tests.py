@@ -1,3 +1,453 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from PIL import Image
+
+from rest_framework import status
+
+from . import crops, imaging, matcher, photos, renditions
+from .management.commands import sweepmedia
+from .models import Blob, Product, ProductFigure, ProductImage
+from .storage import blob_storage
+
+from unittest import mock
+
+import io, json, os, shutil, tempfile, threading
+
+User = get_user_model()
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def image_upload(name='figure.jpg', size=(800, 600), format='JPEG', **params):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, format=format, **params)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class FigureTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='figure@frog.com',
+                                             name='Figure User', password='Figure123')
+
+    def testRenditionWorker(self):
+        """Saving leaves the figure pending and the original untouched"""
+        figure = ProductFigure.objects.create(image=image_upload(), owner=self.user)
+        self.assertTrue(figure.is_pending())
+        self.assertEqual(figure.display_url, figure.image.url)
+        self.assertEqual(Image.open(figure.image.path).size, (800, 600))
+
+        """The worker renders the figure and switches it over"""
+        call_command('renditionworker', processes=1, once=True)
+        figure.refresh_from_db()
+        self.assertEqual(figure.status, ProductFigure.READY)
+        thumb = renditions.get_rendition(figure.image.path, 'thumb')
+        self.assertEqual(figure.display_url, reverse('rendition', kwargs={
+                             'stem': renditions.rendition_stem('thumb'), 'name': figure.image.name}))
+        self.assertEqual(Image.open(default_storage.path(thumb)).size, (256, 192))
+        self.assertEqual(Image.open(figure.image.path).size, (800, 600))
+
+        """Saving without a new image keeps the figure ready"""
+        figure.public = True
+        figure.save()
+        self.assertEqual(figure.status, ProductFigure.READY)
+
+        """Replacing the image makes it pending again"""
+        figure.image = image_upload('another.jpg')
+        figure.save()
+        self.assertTrue(figure.is_pending())
+
+        """Figures claimed by another worker are left to it, until requeued"""
+        ProductFigure.objects.filter(pk=figure.pk).update(status=ProductFigure.RENDERING)
+        call_command('renditionworker', processes=1, once=True)
+        figure.refresh_from_db()
+        self.assertEqual(figure.status, ProductFigure.RENDERING)
+        call_command('renditionworker', processes=1, once=True, requeue=True, stdout=io.StringIO())
+        figure.refresh_from_db()
+        self.assertEqual(figure.status, ProductFigure.READY)
+        self.assertEqual(figure.card_url, reverse('rendition', kwargs={
+                             'stem': renditions.rendition_stem('card'), 'name': figure.image.name}))
+
+        """Figures that cannot be rendered show the original"""
+        ProductFigure.objects.filter(pk=figure.pk).update(status=ProductFigure.FAILED)
+        figure.refresh_from_db()
+        self.assertEqual((figure.display_url, figure.card_url), (figure.image.url, figure.image.url))
+
+    def testRenditionCache(self):
+        """Renditions are keyed on content and built once"""
+        shutil.rmtree(default_storage.path(renditions.RENDITION_ROOT), ignore_errors=True)
+        shutil.rmtree(default_storage.path(renditions.PREVIEW_ROOT), ignore_errors=True)
+        figure = ProductFigure.objects.create(image=image_upload(), owner=self.user)
+        copy = ProductFigure.objects.create(image=image_upload('copy.jpg'), owner=self.user)
+        card = renditions.get_rendition(figure.image.path, 'card')
+        self.assertEqual(card, renditions.get_rendition(copy.image.path, 'card'))
+        self.assertTrue(card.endswith('.jpg'))
+        self.assertEqual(Image.open(default_storage.path(card)).size, (640, 480))
+
+        """Template filters emit the url and srcset"""
+        html = Template("{% load renditions %}{{ figure.image|rendition:'card' }}|{{ figure.image|srcset }}").render(
+                            Context({'figure': figure}))
+        url, srcset = html.split('|')
+        self.assertEqual(url, renditions.rendition_url(figure.image, 'card'))
+        self.assertEqual(srcset.count(','), len(renditions.RENDITION_SIZES) - 1)
+        self.assertIn('{} 640w'.format(url), srcset)
+        self.assertIn('{} 800w'.format(renditions.rendition_url(figure.image, 'hero')), srcset)
+
+        """The least recently used renditions are evicted first"""
+        key = renditions.content_hash(figure.image.path)
+        renditions.get_rendition(figure.image.path, 'thumb')
+        renditions.get_rendition(figure.image.path, 'hero')
+        stale = list(renditions._find(key, 'thumb').values()) + list(renditions._find(key, 'hero').values())
+        for entry in stale:
+            os.utime(entry.path, (0, 0))
+        budget = sum(entry.stat().st_size for entry in renditions._find(key, 'card').values())
+        self.assertEqual(renditions.evict(budget=budget), len(stale))
+        self.assertFalse(renditions._find(key, 'thumb'))
+        self.assertFalse(renditions._find(key, 'hero'))
+        self.assertTrue(os.path.exists(default_storage.path(card)))
+
+        """Misses only evict once enough has been written, and a lost format is rebuilt"""
+        os.remove(default_storage.path(card))
+        with mock.patch.object(renditions, 'evict') as evict:
+            self.assertEqual(renditions.get_rendition(figure.image.path, 'card'), card)
+            evict.assert_not_called()
+            with mock.patch.object(renditions, 'EVICT_INTERVAL_BYTES', 1):
+                renditions.get_rendition(figure.image.path, 'thumb')
+            evict.assert_called_once_with()
+
+        """The widths are those the renditions are rendered at"""
+        portrait = ProductFigure.objects.create(image=image_upload('portrait.jpg', size=(600, 800)), owner=self.user)
+        srcset = renditions.rendition_srcset(portrait.image)
+        self.assertIn('{} 480w'.format(renditions.rendition_url(portrait.image, 'card')), srcset)
+        self.assertEqual(Image.open(default_storage.path(renditions.get_rendition(portrait.image.path, 'card'))).size,
+                         (480, 640))
+        self.assertNotIn('hero', renditions.rendition_srcset(ProductFigure.objects.create(
+                            image=image_upload('small.jpg', size=(200, 100)), owner=self.user).image))
+
+    def testRenditionView(self):
+        """The rendition format follows the Accept header"""
+        figure = ProductFigure.objects.create(image=image_upload(), owner=self.user)
+        url = renditions.rendition_url(figure.image, 'card')
+        response = self.client.get(url, HTTP_ACCEPT='image/jpeg,image/*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Accept', response['Vary'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\xff\xd8'))
+
+        if renditions.WEBP:
+            response = self.client.get(url, HTTP_ACCEPT='image/webp,image/*')
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            response.close()
+
+        """A rendition evicted before it is opened is built again"""
+        get_rendition = renditions.get_rendition
+        names = []
+        def evicted(*args):
+            name = get_rendition(*args)
+            if not names:
+                os.remove(default_storage.path(name))
+            names.append(name)
+            return name
+        with mock.patch.object(renditions, 'get_rendition', side_effect=evicted):
+            response = self.client.get(url, HTTP_ACCEPT='image/jpeg')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(names), 2)
+        response.close()
+
+        """Unknown sizes and images are not found"""
+        response = self.client.get(reverse('rendition', kwargs={'stem': 'card-1x1', 'name': figure.image.name}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('rendition', kwargs={
+                                       'stem': renditions.rendition_stem('card'), 'name': 'figures/missing.jpg'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def testRegenerateRenditions(self):
+        """The backfill resumes after the checkpointed figure"""
+        figures = [ProductFigure.objects.create(image=image_upload(size=(400 + i, 300)), owner=self.user)
+                   for i in range(3)]
+        checkpoint = os.path.join(MEDIA_ROOT, 'checkpoint.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'products.ProductFigure': figures[0].pk}, f)
+
+        out = io.StringIO()
+        call_command('regeneraterenditions', processes=1, chunk=1, checkpoint=checkpoint, stdout=out)
+        self.assertIn('Resuming', out.getvalue())
+        self.assertIn('images/s', out.getvalue())
+        self.assertFalse(os.path.exists(checkpoint))
+
+        key = renditions.content_hash(figures[0].image.path)
+        self.assertFalse(renditions._find(key, 'thumb'))
+        for figure in figures[1:]:
+            key = renditions.content_hash(figure.image.path)
+            for size_name in renditions.RENDITION_SIZES:
+                self.assertTrue(renditions._find(key, size_name))
+
+    def testSweepMedia(self):
+        """Only files no record refers to are swept"""
+        figure = ProductFigure.objects.create(image=image_upload(size=(500, 500)), owner=self.user)
+        orphan = default_storage.save('figures/2019/05/01/orphan.jpg', image_upload('orphan.jpg'))
+        fresh = default_storage.save('figures/2019/05/01/fresh.jpg', image_upload('fresh.jpg'))
+        os.utime(default_storage.path(orphan), (0, 0))
+
+        out = io.StringIO()
+        call_command('sweepmedia', dry_run=True, stdout=out)
+        self.assertIn('Found 1 orphaned', out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command('sweepmedia', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(fresh))
+        self.assertTrue(os.path.exists(figure.image.path))
+
+        """An upload reusing an orphan while the sweep runs keeps the file"""
+        orphan = blob_storage.save('figures/orphan.jpg', image_upload('orphan.jpg', size=(123, 45)))
+        os.utime(blob_storage.path(orphan), (0, 0))
+        sweep = sweepmedia.Command.sweep
+
+        def upload_then_sweep(command, batch):
+            ProductFigure.objects.create(image=image_upload('again.jpg', size=(123, 45)), owner=self.user)
+            sweep(command, batch)
+
+        with mock.patch.object(sweepmedia.Command, 'sweep', upload_then_sweep):
+            call_command('sweepmedia', stdout=io.StringIO())
+        self.assertTrue(os.path.exists(blob_storage.path(orphan)))
+        self.assertEqual(Blob.objects.get(name=orphan).references, 2)
+
+    def testDeduplication(self):
+        """Identical uploads share one content addressed file"""
+        figure = ProductFigure.objects.create(image=image_upload(), owner=self.user)
+        copy = ProductFigure.objects.create(image=image_upload('copy.jpg'), owner=self.user)
+        self.assertEqual(figure.image.name, copy.image.name)
+        self.assertTrue(figure.image.name.startswith('figures/'))
+        self.assertEqual(Blob.objects.get(name=figure.image.name).references, 2)
+
+        """The file is only removed with its last reference"""
+        path = figure.image.path
+        figure.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(name=copy.image.name).references, 1)
+
+        """Replacing an image releases the old file"""
+        copy.image = image_upload('other.jpg', size=(300, 300))
+        copy.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.filter(name=figure.image.name).exists())
+
+        """Uploading the same content again keeps a single reference"""
+        copy.image = image_upload('again.jpg', size=(300, 300))
+        copy.save()
+        self.assertEqual(Blob.objects.get(name=copy.image.name).references, 1)
+        copy.save()
+        self.assertEqual(Blob.objects.get(name=copy.image.name).references, 1)
+
+        """A file lost from under its record is written again by the next upload"""
+        os.remove(copy.image.path)
+        ProductFigure.objects.create(image=image_upload('lost.jpg', size=(300, 300)), owner=self.user)
+        self.assertTrue(os.path.exists(copy.image.path))
+        ProductFigure.objects.filter(image=copy.image.name).exclude(pk=copy.pk).delete()
+        self.assertEqual(Blob.objects.get(name=copy.image.name).references, 1)
+
+        copy.delete()
+        self.assertFalse(Blob.objects.exists())
+
+        """Failed uploads leave no temporary file"""
+        upload = image_upload('broken.jpg')
+        with mock.patch.object(upload, 'chunks', side_effect=IOError('Connection reset')):
+            with self.assertRaises(IOError):
+                ProductFigure.objects.create(image=upload, owner=self.user)
+        self.assertEqual([name for name in os.listdir(default_storage.path('figures')) if name.startswith('.upload-')], [])
+
+
+class PhotoTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='photo@frog.com',
+                                             name='Photo User', password='Photo1234')
+        self.product = Product.objects.create(title='Print', description='A print', owner=self.user)
+        self.slot = self.product.productimage_set.get()
+
+    def testCheckSlot(self):
+        """Photos are classified by the megapixels left after cropping"""
+        self.assertEqual(photos.check_slot(2000, 1500, self.slot)['status'], photos.OK)
+        self.assertEqual(photos.check_slot(1500, 2000, self.slot)['status'], photos.OK)
+        self.assertEqual(photos.check_slot(800, 600, self.slot)['status'], photos.REJECT)
+
+        # Square photo loses a quarter to the crop
+        result = photos.check_slot(1200, 1200, self.slot)
+        self.assertEqual(result['status'], photos.WARN)
+        self.assertAlmostEqual(result['crop_loss'], 0.25, places=3)
+
+        """A fixed orientation slot crops a turned photo heavily"""
+        self.slot.rotatable = False
+        self.assertEqual(photos.check_slot(1500, 2000, self.slot)['status'], photos.WARN)
+
+    def testReadHeader(self):
+        """EXIF orientation is applied without decoding the photo"""
+        exif = Image.Exif()
+        exif[photos.EXIF_ORIENTATION] = 6
+        upload = image_upload(size=(400, 300), exif=exif.tobytes())
+        self.assertEqual(photos.read_header(upload), (300, 400))
+
+    def testCheckPhotosView(self):
+        """The endpoint returns a result per photo and slot"""
+        url = reverse('check_photos', kwargs={'pk': self.product.pk})
+        self.client.login(email='photo@frog.com', password='Photo1234')
+        response = self.client.post(url, {'photos': [
+            image_upload('good.jpg', size=(2000, 1500)),
+            SimpleUploadedFile('broken.jpg', b'not an image'),
+        ]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        good, broken = response.json()['photos']
+        self.assertEqual(good['name'], 'good.jpg')
+        self.assertEqual(good['status'], photos.OK)
+        self.assertEqual(good['slots'][0]['slot'], self.slot.pk)
+        self.assertEqual(broken['status'], photos.REJECT)
+
+
+class MatcherTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='match@frog.com',
+                                             name='Match User', password='Match1234')
+        self.square = Product.objects.create(title='Square', description='Square print', owner=self.user)
+        self.square.productimage_set.update(ratio=1, min_megapixels=1, warn_megapixels=2)
+        self.poster = Product.objects.create(title='Poster', description='Large print', owner=self.user)
+        self.poster.productimage_set.update(ratio=1.5, rotatable=False, min_megapixels=4, warn_megapixels=8)
+        ProductImage.objects.create(product=self.poster, ratio=0.667, rotatable=False,
+                                    min_megapixels=4, warn_megapixels=8)
+        self.slots = list(ProductImage.objects.values_list('pk', 'product', 'ratio', 'rotatable',
+                                                           'min_megapixels', 'warn_megapixels'))
+
+    def testFitMatrix(self):
+        """The vectorized fit agrees with the per slot check"""
+        sizes = [(4000, 3000, 1), (3000, 4000, 1), (4000, 3000, 6), (1200, 1200, 1), (640, 480, 1)]
+        status, crop_loss, megapixels = matcher.fit_matrix(sizes, self.slots)
+        slots = list(ProductImage.objects.all())
+        for row, (width, height, orientation) in enumerate(sizes):
+            if orientation == 6:
+                width, height = height, width
+            for column, slot in enumerate(slots):
+                result = photos.check_slot(width, height, slot)
+                self.assertEqual(matcher.STATUSES[status[row, column]], result['status'])
+                self.assertAlmostEqual(crop_loss[row, column], result['crop_loss'], places=4)
+
+    def testSuggestProducts(self):
+        """Products are ranked by their best slot, rejected products left out"""
+        landscape, portrait, small = matcher.suggest_products(
+                            [(6000, 4000, 1), (4000, 6000, 1), (800, 600, 1)], self.slots)
+        self.assertEqual([s['product'] for s in landscape], [self.poster.pk, self.square.pk])
+        self.assertEqual([s['product'] for s in portrait], [self.poster.pk, self.square.pk])
+        self.assertNotEqual(landscape[0]['slot'], portrait[0]['slot'])
+        self.assertEqual(small, [])
+        self.assertEqual(matcher.suggest_products([(800, 600, 1)], []), [[]])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CropTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='crop@frog.com',
+                                             name='Crop User', password='Crop12345')
+        product = Product.objects.create(title='Square', description='Square print', owner=self.user)
+        self.square = product.productimage_set.get()
+        self.square.ratio = 1
+        self.landscape = ProductImage(product=product, ratio=1.5, rotatable=False)
+
+    def photo(self, name, size, **params):
+        path = os.path.join(MEDIA_ROOT, name)
+        with open(path, 'wb') as f:
+            f.write(image_upload(name, size=size, **params).read())
+        return path
+
+    def testPlanCrops(self):
+        """Crops are centred and turned for rotatable slots"""
+        boxes, turned = crops.plan_crops([(3000, 2000), (2000, 3000), (2000, 3000)],
+                                         [self.square, self.landscape, ProductImage(ratio=1.5)])
+        self.assertEqual(boxes.tolist(), [[500, 0, 2500, 2000], [0, 833, 2000, 2167], [0, 0, 2000, 3000]])
+        self.assertEqual(turned.tolist(), [False, False, True])
+
+    def testPlanOrder(self):
+        """Previews are rendered from the cropped region of each photo"""
+        exif = Image.Exif()
+        exif[photos.EXIF_ORIENTATION] = 6
+        turned = self.photo('turned.jpg', (2400, 1600), exif=exif.tobytes())
+        flat = self.photo('flat.png', (900, 300), format='PNG')
+
+        plans = crops.plan_order([(turned, self.landscape), (flat, self.square)], processes=2)
+        self.assertEqual(plans[0]['box'], (0, 667, 1600, 1733))
+        self.assertEqual(plans[1]['box'], (300, 0, 600, 300))
+
+        preview = Image.open(default_storage.path(plans[0]['preview']))
+        self.assertEqual(preview.size, (300, 200))
+        self.assertEqual(Image.open(default_storage.path(plans[1]['preview'])).size, (300, 300))
+
+        """Previews are evicted with the renditions"""
+        for plan in plans:
+            os.utime(default_storage.path(plan['preview']), (0, 0))
+        renditions.evict(budget=0)
+        self.assertFalse(any(default_storage.exists(plan['preview']) for plan in plans))
+
+        """Previews follow the preview size"""
+        with mock.patch.object(crops, 'PREVIEW_SIZE', (150, 150)):
+            plan, = crops.plan_order([(flat, self.square)], processes=1)
+        self.assertEqual(Image.open(default_storage.path(plan['preview'])).size, (150, 150))
+
+    def testPreviewCropsView(self):
+        """Uploaded photos are cropped to their slots and previewed"""
+        self.square.save()
+        url = reverse('preview_crops', kwargs={'pk': self.square.product_id})
+        self.client.login(email='crop@frog.com', password='Crop12345')
+        response = self.client.post(url, {'photos': [image_upload('wide.jpg', size=(900, 300))],
+                                          'slots': [self.square.pk]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        crop, = response.json()['crops']
+        self.assertEqual((crop['name'], crop['slot'], crop['box']), ('wide.jpg', self.square.pk, [300, 0, 600, 300]))
+        self.assertTrue(crop['preview'].startswith(default_storage.url(renditions.PREVIEW_ROOT)))
+
+        """Photos without a slot of the product, or unreadable, are refused"""
+        for data in ({'photos': [image_upload()]}, {'photos': [image_upload()], 'slots': [0]},
+                     {'photos': [SimpleUploadedFile('broken.jpg', b'not an image')], 'slots': [self.square.pk]}, {}):
+            response = self.client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImagingTest(TestCase):
+    def testPixelCap(self):
+        """Images over the pixel cap are refused before decoding"""
+        with mock.patch.object(imaging, 'MAX_IMAGE_PIXELS', 1000):
+            with self.assertRaises(Image.DecompressionBombError):
+                imaging.open_image(image_upload(size=(100, 100)))
+
+    def testReducedDecoding(self):
+        """JPEGs are decoded at a reduced scale within the budget"""
+        with imaging.open_reduced(image_upload(size=(2000, 1600)), (256, 256)) as image:
+            self.assertEqual(image.size, (500, 400))
+            self.assertEqual(imaging.budget.in_use, 500 * 400)
+        self.assertEqual(imaging.budget.in_use, 0)
+        self.assertGreaterEqual(imaging.metrics()['peak_megapixels'], 0.2)
+
+    def testPixelBudget(self):
+        """Decodes wait until their pixels fit the budget"""
+        budget = imaging.PixelBudget(100)
+        budget.acquire(80)
+        waiting = threading.Thread(target=budget.acquire, args=(50,))
+        waiting.start()
+        waiting.join(0.1)
+        self.assertTrue(waiting.is_alive())
+
+        budget.release(80)
+        waiting.join(1)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual((budget.in_use, budget.peak, budget.waits), (50, 80, 1))
+
+        # Larger than the whole budget, runs alone
+        budget.release(50)
+        self.assertEqual(budget.acquire(500), 100)
@@ -8,6 +8,8 @@ urlpatterns = [
     path('<int:pk>/', views.DetailedProductView.as_view(), name='detailed_product'),
     path('edit/<int:pk>/', views.EditProductView.as_view(), name='edit_product'),
     path('delete/<int:pk>/', views.DeleteProductView.as_view(), name='delete_product'),
+    path('check/<int:pk>/', views.CheckPhotosView.as_view(), name='check_photos'),
+    path('check/<int:pk>/previews/', views.PreviewCropsView.as_view(), name='preview_crops'),
 
     path('print/create/<int:pk>/', views.CreatePrintView.as_view(), name='create_print'),
     path('print/edit/<int:pk>/', views.EditPrintView.as_view(), name='edit_print'),
@@ -24,4 +26,6 @@ urlpatterns = [
     path('figure/<int:pk>/', views.DetailedFigureView.as_view(), name='detailed_figure'),
     path('figure/edit/<int:pk>/', views.EditFigureView.as_view(), name='edit_figure'),
     path('figure/delete/<int:pk>/', views.DeleteFigureView.as_view(), name='delete_figure'),
+
+    path('rendition/<slug:stem>/<path:name>', views.RenditionView.as_view(), name='rendition'),
 ]
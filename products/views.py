@@ -1,18 +1,28 @@
 from django.contrib import messages
 from django.contrib.auth import login, get_user_model
 from django.contrib.auth.decorators import login_required
-from django.http import Http404
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_list_or_404, get_object_or_404, render, redirect
 from django.views.generic import CreateView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, FormView, UpdateView
 from django.views.generic.list import ListView
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.decorators import method_decorator
 from django.views import View
 
+from .crops import MAX_PREVIEW_PHOTOS, plan_order
 from .forms import ProductForm, ProductCategoryForm, ProductFigureForm, ProductImageForm
 from .models import ProductFigure, ProductCategory, Product, ProductImage
+from .photos import check_photo
+from .renditions import CONTENT_TYPES, RENDITION_SIZES, open_rendition, rendition_stem
+from .storage import image_roots
+
+from PIL import Image
+
+import os, tempfile
 
 User = get_user_model()
 
@@ -23,7 +33,7 @@ class ListProductView(ListView):
 
     # Only show the items that the user 'owns'
     def get_queryset(self):
-        queryset = self.model.objects.filter(owner=self.request.user)
+        queryset = self.model.objects.filter(owner=self.request.user).select_related('product_figure')
         return queryset
 
 
@@ -86,6 +96,88 @@ class DeleteProductView(View):
         return redirect(self.success_url)
 
 
+"""Serve a figure or logo rendition in the best format the browser accepts.
+
+The url holds the rendition dimensions and the content addressed image name,
+so responses are cached for a year.
+"""
+class RenditionView(View):
+    def get(self, request, stem, name):
+        size_name = stem.rsplit('-', 1)[0]
+        if size_name not in RENDITION_SIZES or stem != rendition_stem(size_name):
+            raise Http404
+
+        storage = image_roots().get(name.split('/', 1)[0])
+        if storage is None or not storage.exists(name):
+            raise Http404
+
+        webp = 'image/webp' in self.request.META.get('HTTP_ACCEPT', '')
+        try:
+            rendition, extension = open_rendition(storage.path(name), size_name, webp)
+        except (IOError, ValueError, Image.DecompressionBombError):
+            raise Http404
+
+        response = FileResponse(rendition, content_type=CONTENT_TYPES[extension])
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+"""Check uploaded photos against every image slot of a product, reading headers only"""
+@method_decorator(login_required, name='dispatch')
+class CheckPhotosView(View):
+    def post(self, request, **kwargs):
+        product = get_object_or_404(Product, pk=self.kwargs['pk'])
+        slots = list(ProductImage.objects.filter(product=product).order_by('pk'))
+
+        photos = []
+        for photo in self.request.FILES.getlist('photos'):
+            result = check_photo(photo, slots)
+            result['name'] = photo.name
+            photos.append(result)
+
+        return JsonResponse({'product': product.pk, 'photos': photos})
+
+
+"""Crop uploaded photos to the product's slots and render a preview of each crop.
+
+The photos are posted with, in the same order, the pk of the slot each one
+is assigned to.
+"""
+@method_decorator(login_required, name='dispatch')
+class PreviewCropsView(View):
+    def post(self, request, **kwargs):
+        product = get_object_or_404(Product, pk=self.kwargs['pk'])
+        slots = {str(slot.pk): slot for slot in ProductImage.objects.filter(product=product)}
+        uploads = self.request.FILES.getlist('photos')
+        assigned = self.request.POST.getlist('slots')
+        if not 1 <= len(uploads) <= MAX_PREVIEW_PHOTOS:
+            return JsonResponse({'is_valid': False,
+                                 'error': 'Between 1 and {} photos can be previewed at once.'.format(MAX_PREVIEW_PHOTOS)}, status=400)
+        if len(assigned) != len(uploads) or not all(pk in slots for pk in assigned):
+            return JsonResponse({'is_valid': False, 'error': 'Every photo needs a slot of this product.'}, status=400)
+
+        with tempfile.TemporaryDirectory() as directory:
+            assignments = []
+            for index, (upload, pk) in enumerate(zip(uploads, assigned)):
+                path = os.path.join(directory, str(index))
+                with open(path, 'wb') as f:
+                    for chunk in upload.chunks():
+                        f.write(chunk)
+                assignments.append((path, slots[pk]))
+
+            # The previews of one request are rendered in process, the pool is for larger batches
+            try:
+                plans = plan_order(assignments, processes=1)
+            except (IOError, SyntaxError, Image.DecompressionBombError):
+                return JsonResponse({'is_valid': False, 'error': 'Cannot read the photos.'}, status=400)
+
+        for plan, upload in zip(plans, uploads):
+            plan['name'] = upload.name
+            plan['preview'] = default_storage.url(plan['preview'])
+        return JsonResponse({'is_valid': True, 'product': product.pk, 'crops': plans})
+
+
 @method_decorator(login_required, name='dispatch')
 class CreatePrintView(CreateView):
     template_name = 'print/create.html'
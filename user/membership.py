@@ -0,0 +1,24 @@
+# Attribute the memberships are cached in on the user object
+CACHE_ATTR = '_group_memberships'
+
+
+"""{group pk: admin} for every group of an active user, loaded once per user object.
+
+request.user is built afresh for each request, so the memberships of the
+requesting user are read with one query per request however many checks are
+made. Anonymous and inactive users belong to no group.
+"""
+def memberships(user):
+    if not getattr(user, 'is_authenticated', False) or not user.is_active:
+        return {}
+    try:
+        return getattr(user, CACHE_ATTR)
+    except AttributeError:
+        groups = dict(user.groupuser_set.values_list('group', 'admin'))
+        setattr(user, CACHE_ATTR, groups)
+        return groups
+
+
+"""Drop the cached memberships, called when a membership of the user is saved or deleted"""
+def forget(user):
+    user.__dict__.pop(CACHE_ATTR, None)
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.1 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+def fill_search_columns(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    users = []
+    for user in User.objects.only('email', 'name').iterator():
+        user.email_search = ' '.join(user.email.split()).casefold()
+        user.name_search = ' '.join(user.name.split()).casefold()
+        users.append(user)
+    User.objects.bulk_update(users, ['email_search', 'name_search'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email_search',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='name_search',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=128),
+        ),
+        migrations.RunPython(fill_search_columns, migrations.RunPython.noop),
+    ]
@@ -2,10 +2,18 @@ from django.core.mail import send_mail
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.base_user import AbstractBaseUser,BaseUserManager
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 
+from .membership import memberships
+
 import datetime
 
+
+"""Normalised form of an email or name in the search columns"""
+def search_key(value):
+    return ' '.join((value or '').split()).casefold()
+
 class CustomUserManager(BaseUserManager):
     use_in_migrations = True
 
@@ -36,6 +44,20 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
         return self._create_user(email, password, **extra_fields)
 
+    """Active users whose email or name starts with query, ignoring case.
+
+    Matches are prefix LIKE scans on the lowercase search columns. On
+    PostgreSQL these use the varchar_pattern_ops index that db_index adds,
+    whatever the collation, so the cost does not grow with the size of the
+    user table.
+    """
+    def search(self, query):
+        query = search_key(query)
+        if not query:
+            return self.none()
+        return self.filter(Q(email_search__startswith=query) | Q(name_search__startswith=query),
+                           is_active=True)
+
 
 
 class User(AbstractBaseUser):
@@ -47,6 +69,8 @@ class User(AbstractBaseUser):
     is_staff = models.BooleanField(_('staff user'), default=False)
     is_superuser = models.BooleanField(_('super user'), default=False)
     date_joined = models.DateTimeField(_('date joined'), auto_now_add=True)
+    email_search = models.CharField(max_length=254, db_index=True, editable=False, default='')
+    name_search = models.CharField(max_length=128, db_index=True, editable=False, default='')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [ 'name' ]
@@ -61,6 +85,14 @@ class User(AbstractBaseUser):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        self.email_search = search_key(self.email)
+        self.name_search = search_key(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'email', 'name'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'email_search', 'name_search'}
+        super(User, self).save(*args, **kwargs)
+
     def email_user(self, subject, message, from_email=None, **kwargs):
         """ Sends an email to this User. """
         send_mail(subject, message, from_email, [self.email], **kwargs)
@@ -90,18 +122,10 @@ class Group(models.Model):
         return GroupUser.objects.filter(group=self).order_by('user')
 
     def is_member(self, user):
-        if GroupUser.objects.filter(group=self, user=user,
-                                    user__is_active=True):
-            return True
-        else:
-            return False
+        return self.pk in memberships(user)
 
     def is_admin(self, user):
-        if GroupUser.objects.filter(group=self, user=user,
-                                    user__is_active=True, admin=True):
-            return True
-        else:
-            return False
+        return memberships(user).get(self.pk, False)
 
     # Email all active members
     def email_all(self, subject, message, from_email=None, **kwargs):
@@ -2,12 +2,16 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.models import Site
 from django.core.mail import mail_admins
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 
+from .membership import forget
+from .models import Group, GroupUser
+
 User = get_user_model()
 current_site = Site.objects.get_current()
 
@@ -30,3 +34,18 @@ def post_check_email(sender, instance, created, **kwargs):
             'token': default_token_generator.make_token(instance),
         })
         instance.email_user(subject, message)
+
+# Member lists are versioned by the group's date_updated, touch it when a member changes.
+# The user object the membership was made with no longer has the right memberships.
+@receiver(post_save,sender=GroupUser)
+@receiver(post_delete,sender=GroupUser)
+def touch_group(sender, instance, **kwargs):
+    Group.objects.filter(pk=instance.group_id).update(date_updated=timezone.now())
+    if sender.user.is_cached(instance):
+        forget(instance.user)
+
+# Names, emails and the active flag show in the member lists of the user's groups
+@receiver(post_save,sender=User)
+def touch_user_groups(sender, instance, created, update_fields=None, **kwargs):
+    if not created and not (update_fields and update_fields.isdisjoint({'name', 'email', 'is_active'})):
+        Group.objects.filter(groupuser__user=instance).update(date_updated=timezone.now())
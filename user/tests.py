@@ -308,3 +308,23 @@ class SimpleTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual("application/xml", response['Content-Type'])
         self.assertNotEqual(len(response.context['urlset']), 0)
+
+
+    def testUserSearch(self):
+        """Search users by email and name prefix, ignoring case"""
+        self.assertEqual(list(User.objects.search('FRED@')), [self.user])
+        self.assertEqual(list(User.objects.search('  test  us')), [self.user])
+        self.assertFalse(User.objects.search('red').exists())
+        self.assertFalse(User.objects.search('').exists())
+
+        """The search columns follow the email and name"""
+        self.user.name = 'Frederick \U0001F642\U0001F642'
+        self.user.save(update_fields=['name'])
+        self.assertEqual(User.objects.get(pk=self.user.pk).name_search, 'frederick \U0001F642\U0001F642')
+        self.assertEqual(list(User.objects.search('frederick \U0001F642')), [self.user])
+        self.assertEqual(list(User.objects.search('Frederick%')), [])
+
+        """Inactive users are not found"""
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(User.objects.search('fred').exists())